@@ -1,25 +1,31 @@
 #!/usr/bin/env python3
 """Sweet Shop Management System - CLI"""
 
+import json
+import sys
+import integrity
 from sweet_shop_manager import (
-    SweetShopManager, SweetCategory,
+    SweetShopManager, Sweet, SweetCategory,
     InsufficientStockError, SweetNotFoundError
 )
 
 class SweetShopCLI:
     def __init__(self):
-        self.shop = SweetShopManager()
         self.data_file = "sweet_shop_data.json"
         self.load_data()
         if not self.shop.view_all_sweets():
             self.load_sample_data()
 
     def load_data(self):
+        self.shop = SweetShopManager(self.data_file)
         try:
-            self.shop.load_from_file(self.data_file)
-            print(f"Loaded data from {self.data_file}")
-        except:
-            print("No existing data found. Starting fresh.")
+            recovery = self.shop.last_recovery  # first access loads the inventory
+        except integrity.CorruptDataError as e:
+            print(f"Error: {e}")
+            raise SystemExit(1)
+        if recovery is not None:
+            print(recovery)
+        print(f"Loaded data from {self.data_file}")
 
     def save_data(self):
         try:
@@ -107,7 +113,7 @@ class SweetShopCLI:
             print(f"Error: {e}")
 
     def search_sweets(self):
-        print("\nSearch by: 1. Name  2. Category  3. Price Range")
+        print("\nSearch by: 1. Name  2. Category  3. Price Range  4. Fuzzy Name")
         try:
             ch = int(input("Choice: "))
             if ch == 1:
@@ -121,6 +127,9 @@ class SweetShopCLI:
                 min_p = float(input("Min price: ₹"))
                 max_p = float(input("Max price: ₹"))
                 self.display_table(self.shop.search_by_price_range(min_p, max_p), f"₹{min_p} - ₹{max_p}")
+            elif ch == 4:
+                term = input("Name (typos allowed): ")
+                self.display_table(self.shop.fuzzy_search(term), f"Closest to '{term}'")
         except:
             print("Invalid input.")
 
@@ -175,20 +184,41 @@ class SweetShopCLI:
 
     def reports(self):
         print("\n--- Reports ---")
-        print(f"Total inventory value: ₹{self.shop.get_total_inventory_value():.2f}")
-        lows = self.shop.get_low_stock_sweets()
+        from jobs import JobManager
+        jobs = JobManager(self.data_file)
+        try:
+            job = jobs.submit('report', self.shop.version)
+            while job.status not in ('done', 'failed'):
+                try:
+                    jobs.wait(job.id, timeout=0.5)
+                except TimeoutError:
+                    print(f"Generating report... {jobs.status(job.id)['progress']:.0%}")
+            if job.status == 'failed':
+                print(f"Error: {job.error}")
+                return
+            with open(job.result_path) as f:
+                report = json.load(f)
+        finally:
+            jobs.shutdown()
+        print(f"Total inventory value: ₹{report['total_value']:.2f}")
+        lows = [Sweet.from_dict(s) for s in report['low_stock']]
         self.display_table(lows, "Low Stock Items") if lows else print("No low stock items.")
         print("\nCategory Summary:")
-        summary = {}
-        for s in self.shop.view_all_sweets():
-            d = summary.setdefault(s.category, {'count': 0, 'value': 0})
-            d['count'] += 1
-            d['value'] += s.price * s.quantity
-        for cat, d in summary.items():
-            print(f"{cat.value:<15} {d['count']:>2} items, ₹{d['value']:>8.2f}")
+        for cat, d in report['categories'].items():
+            print(f"{cat:<15} {d['count']:>2} items, ₹{d['value']:>8.2f}")
 
     def run(self):
         print("Welcome to Sweet Shop Management System!")
+        from jobs import CACHE_DIR
+        from scheduler import maintenance_scheduler
+        scheduler = maintenance_scheduler(self.data_file, cache_dir=CACHE_DIR)
+        scheduler.start()
+        try:
+            self.menu_loop()
+        finally:
+            scheduler.shutdown()
+
+    def menu_loop(self):
         while True:
             self.display_menu()
             choice = input("Choice: ").strip()
@@ -211,7 +241,14 @@ class SweetShopCLI:
                 print("Invalid choice.")
             input("\nPress Enter to continue...")
 
+def fsck(filename):
+    report = integrity.verify(filename)
+    print(report)
+    return 0 if report.ok else 1
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'fsck':
+        sys.exit(fsck(sys.argv[2] if len(sys.argv) > 2 else "sweet_shop_data.json"))
     SweetShopCLI().run()
 
 if __name__ == "__main__":
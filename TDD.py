@@ -5,11 +5,28 @@ Following TDD principles with comprehensive test coverage
 
 import unittest
 import tempfile
+import base64
+import json
+import marshal
 import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from unittest import mock
 from sweet_shop_manager import (
     SweetShopManager, Sweet, SweetCategory,
-    InsufficientStockError, SweetNotFoundError, DuplicateSweetError
+    InsufficientStockError, SweetNotFoundError, DuplicateSweetError,
+    BulkRule, RuleOp, catalogue_cache_path
 )
+from jobs import JobManager
+from scheduler import Scheduler, LowStockAlerter, check_integrity, checkpoint, compact
+import integrity
+from image_store import ImageStore, import_images
+import loadgen
+from fuzzy import BKTree, FuzzyIndex, normalize
 
 
 class TestSweet(unittest.TestCase):
@@ -366,5 +383,846 @@ class TestSweetShop(unittest.TestCase):
             items_after = sweet_shop_manager.get_all_items()
             self.assertFalse(any(i['id'] == last_id for i in items_after))
 
+class TestBulkUpdate(unittest.TestCase):
+    """Test cases for catalogue-wide repricing rules"""
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        os.remove(self.path)
+        self.shop = SweetShopManager(self.path)
+        self.shop.add_item("Gulab Jamun", 50, 20.0, "Milk-Based")
+        self.shop.add_item("Kaju Katli", 4, 52.0, "Nut-Based")
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_preview_does_not_modify(self):
+        """Test previewing rules returns a diff without changing the catalogue"""
+        rules = [BulkRule('price', RuleOp.PERCENT, 8, SweetCategory.MILK_BASED)]
+        changes = self.shop.preview_bulk_update(rules)
+
+        self.assertEqual(len(changes), 1)
+        self.assertEqual((changes[0].old, changes[0].new), (20.0, 21.6))
+        self.assertEqual(self.shop.search_by_name("Gulab")[0].price, 20.0)
+
+    def test_apply_rules_persists(self):
+        """Test applying chained rules and reloading them from disk"""
+        rules = [
+            BulkRule('price', RuleOp.ROUND, 5),
+            BulkRule('quantity', RuleOp.AT_LEAST, 10),
+        ]
+        self.shop.apply_bulk_update(rules)
+
+        reloaded = SweetShopManager(self.path)
+        katli = reloaded.search_by_name("Kaju")[0]
+        self.assertEqual(katli.price, 50.0)
+        self.assertEqual(katli.quantity, 10)
+
+    def test_negative_result_rejected(self):
+        """Test a rule that would make prices negative raises ValueError"""
+        with self.assertRaises(ValueError):
+            self.shop.apply_bulk_update([BulkRule('price', RuleOp.PERCENT, -150)])
+
+    def test_op_given_as_string(self):
+        """Test string operations are coerced and unknown ones rejected"""
+        changes = self.shop.preview_bulk_update([BulkRule('price', 'percent', 8)])
+        self.assertEqual([c.new for c in changes], [21.6, 56.16])
+
+        with self.assertRaises(ValueError):
+            BulkRule('price', 'discount', 8)
+
+    def test_category_given_as_string(self):
+        """Test string categories are coerced so the rule still matches"""
+        changes = self.shop.preview_bulk_update([BulkRule('price', 'percent', 10, 'Milk-Based')])
+        self.assertEqual([(c.name, c.new) for c in changes], [("Gulab Jamun", 22.0)])
+
+        with self.assertRaises(ValueError):
+            BulkRule('price', 'percent', 10, 'Bogus')
+
+    def test_untouched_values_not_rounded(self):
+        """Test rules leave values they do not change exactly as stored"""
+        self.shop.update_item(1001, "Gulab Jamun", 50, 10.125)
+        changes = self.shop.preview_bulk_update([BulkRule('quantity', RuleOp.AT_LEAST, 10)])
+
+        self.assertEqual([(c.field, c.new) for c in changes], [('quantity', 10)])
+
+    def test_non_finite_value_rejected(self):
+        """Test NaN and infinite rule values raise ValueError"""
+        for value in (float('nan'), float('inf')):
+            with self.assertRaises(ValueError):
+                BulkRule('price', RuleOp.SET, value)
+
+
+class TestJobManager(unittest.TestCase):
+    """Test cases for background report and export jobs"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.shop = SweetShopManager(os.path.join(self.tmpdir.name, 'data.json'))
+        self.shop.add_item("Kaju Katli", 3, 50.0, "Nut-Based")
+        self.shop.add_item("Gulab Jamun", 50, 20.0, "Milk-Based")
+        self.jobs = JobManager(self.shop.filename, cache_dir=os.path.join(self.tmpdir.name, 'cache'))
+
+    def tearDown(self):
+        self.jobs.shutdown()
+        self.tmpdir.cleanup()
+
+    def test_report_job(self):
+        """Test a report job runs in the background and produces a result"""
+        job = self.jobs.wait(self.jobs.submit('report', self.shop.version).id, timeout=30)
+
+        self.assertEqual(job.status, 'done')
+        with open(job.result_path) as f:
+            report = json.load(f)
+        self.assertEqual(report['total_value'], 1150.0)
+        self.assertEqual([s['name'] for s in report['low_stock']], ["Kaju Katli"])
+
+    def test_repeated_job_served_from_cache(self):
+        """Test the same job for the same inventory version is cached"""
+        first = self.jobs.submit('export', self.shop.version, fmt='csv')
+        self.jobs.wait(first.id, timeout=30)
+        second = self.jobs.submit('export', self.shop.version, fmt='csv')
+
+        self.assertTrue(second.cached)
+        self.assertEqual(self.jobs.status(second.id)['status'], 'done')
+
+        self.shop.add_item("Jalebi", 35, 15.0, "Candy")
+        third = self.jobs.submit('export', self.shop.version, fmt='csv')
+        self.assertFalse(third.cached)
+
+    def test_identical_jobs_share_one_run(self):
+        """Test a second identical submit joins the job already running"""
+        first = self.jobs.submit('export', self.shop.version, fmt='csv')
+        second = self.jobs.submit('export', self.shop.version, fmt='csv')
+
+        self.assertIs(second, first)
+        self.assertEqual(self.jobs.wait(first.id, timeout=30).status, 'done')
+        self.assertEqual(os.listdir(self.jobs.cache_dir), [os.path.basename(first.result_path)])
+
+    def test_job_for_old_version_fails(self):
+        """Test a job never caches a newer inventory under an older version"""
+        version = self.shop.version
+        self.shop.add_item("Jalebi", 35, 15.0, "Candy")
+
+        job = self.jobs.wait(self.jobs.submit('report', version).id, timeout=30)
+
+        self.assertEqual(job.status, 'failed')
+        self.assertFalse(os.path.exists(job.result_path))
+
+    def test_recreated_file_not_served_stale_result(self):
+        """Test a recreated file with a reused version number gets a fresh result"""
+        first = self.jobs.wait(self.jobs.submit('report', self.shop.version).id, timeout=30)
+        os.remove(self.shop.filename)
+        shop = SweetShopManager(self.shop.filename)
+        shop.add_item("Kaju Katli", 1, 50.0, "Nut-Based")
+        shop.add_item("Jalebi", 1, 10.0, "Candy")
+        self.assertEqual(shop.version, self.shop.version)
+
+        second = self.jobs.wait(self.jobs.submit('report', shop.version).id, timeout=30)
+        self.assertFalse(second.cached)
+        self.assertNotEqual(second.result_path, first.result_path)
+        with open(second.result_path) as f:
+            self.assertEqual(json.load(f)['total_value'], 60.0)
+
+    def test_finished_jobs_are_pruned(self):
+        """Test the job table does not grow without bound"""
+        with mock.patch('jobs.MAX_FINISHED_JOBS', 2):
+            self.jobs.wait(self.jobs.submit('report', self.shop.version).id, timeout=30)
+            ids = [self.jobs.submit('report', self.shop.version).id for _ in range(5)]
+
+        with self.assertRaises(KeyError):
+            self.jobs.get(ids[0])
+        self.assertEqual(self.jobs.get(ids[-1]).status, 'done')
+
+
+class TestScheduler(unittest.TestCase):
+    """Test cases for the background maintenance scheduler"""
+
+    def setUp(self):
+        self.scheduler = Scheduler()
+
+    def tearDown(self):
+        self.scheduler.shutdown(final_flush=False)
+
+    def test_task_runs_periodically(self):
+        """Test a task runs repeatedly at its interval"""
+        task = self.scheduler.add_task('tick', lambda: None, 0.01)
+        self.scheduler.start()
+        time.sleep(0.2)
+
+        self.assertGreater(task.runs, 2)
+
+    def test_overlapping_run_is_skipped(self):
+        """Test a task is skipped while its previous run is still going"""
+        release = threading.Event()
+        task = self.scheduler.add_task('slow', release.wait, 0.01)
+        self.scheduler.start()
+        time.sleep(0.1)
+        release.set()
+
+        self.assertGreater(task.skipped, 0)
+
+    def test_shutdown_runs_final_flush(self):
+        """Test tasks marked run_on_shutdown run once more on shutdown"""
+        flushed = []
+        self.scheduler.add_task('flush', lambda: flushed.append(True), 3600, run_on_shutdown=True)
+        self.scheduler.start()
+        self.scheduler.shutdown()
+
+        self.assertEqual(flushed, [True])
+
+    def test_check_integrity_reports_bad_records(self):
+        """Test the integrity task flags invalid records"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'data.json')
+            with open(path, 'w') as f:
+                json.dump({'sweets': [{'id': 1, 'name': 'Jalebi', 'price': -1, 'quantity': 3}],
+                           'next_id': 2}, f)
+
+            self.assertEqual(len(check_integrity(path)), 1)
+
+
+class TestMaintenanceTasks(unittest.TestCase):
+    """Test cases for the checkpoint, compaction and low-stock tasks"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'a.json')
+        self.shop = SweetShopManager(self.path)
+        self.shop.add_item("Kaju Katli", 20, 50.0, "Nut-Based")
+        self.shop.add_item("Jalebi", 3, 15.0, "Candy")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_checkpoint_skips_unchanged_version(self):
+        """Test a checkpoint is only taken when the inventory changed"""
+        first = checkpoint(self.path)
+        self.assertIsNone(checkpoint(self.path))
+        self.assertTrue(integrity.verify(first).ok)
+
+        self.shop.add_item("Rasgulla", 40, 12.0, "Milk-Based")
+        self.assertIsNotNone(checkpoint(self.path))
+        self.assertEqual(len(os.listdir(integrity.checkpoint_dir(self.path))), 4)
+
+    def test_checkpoint_refuses_corrupt_file(self):
+        """Test a file failing verification is never copied into a checkpoint"""
+        with open(self.path, 'rb') as f:
+            raw = f.read()
+        with open(self.path, 'wb') as f:
+            f.write(raw.replace(b'Jalebi', b'Jalxbi'))
+
+        self.assertIsNone(checkpoint(self.path))
+        self.assertFalse(os.path.exists(integrity.checkpoint_dir(self.path)))
+
+    def test_compact_only_prunes_own_cache_entries(self):
+        """Test compaction leaves other data files' cached results alone"""
+        cache_dir = os.path.join(self.tmpdir.name, 'cache')
+        other = SweetShopManager(os.path.join(self.tmpdir.name, 'b.json'))
+        other.add_item("Ladoo", 5, 10.0, "Candy")
+        jobs = JobManager(self.path, cache_dir=cache_dir)
+        other_jobs = JobManager(other.filename, cache_dir=cache_dir)
+        try:
+            old = jobs.wait(jobs.submit('report', self.shop.version).id, timeout=30)
+            theirs = other_jobs.wait(other_jobs.submit('report', other.version).id, timeout=30)
+            self.shop.add_item("Rasgulla", 40, 12.0, "Milk-Based")
+            current = jobs.wait(jobs.submit('report', self.shop.version).id, timeout=30)
+        finally:
+            jobs.shutdown()
+            other_jobs.shutdown()
+
+        self.assertEqual(compact(self.path, cache_dir), 1)
+        self.assertFalse(os.path.exists(old.result_path))
+        self.assertTrue(os.path.exists(current.result_path))
+        self.assertTrue(os.path.exists(theirs.result_path))
+
+    def test_compact_keeps_newest_checkpoints(self):
+        """Test compaction removes all but the newest checkpoints and their manifests"""
+        for quantity in range(4):
+            self.shop.update_item(1001, "Kaju Katli", quantity, 50.0)
+            checkpoint(self.path)
+
+        self.assertEqual(compact(self.path, keep=2), 2)
+        self.assertEqual(len(os.listdir(integrity.checkpoint_dir(self.path))), 4)
+
+    def test_low_stock_alerts_once(self):
+        """Test an item is reported when it drops low, and not again until it recovers"""
+        alerter = LowStockAlerter(self.path, threshold=5)
+
+        self.assertEqual([s['name'] for s in alerter()], ["Jalebi"])
+        self.assertEqual(alerter(), [])
+        self.shop.update_item(1002, "Jalebi", 30, 15.0)
+        self.assertEqual(alerter(), [])
+        self.shop.update_item(1002, "Jalebi", 2, 15.0)
+        self.assertEqual([s['name'] for s in alerter()], ["Jalebi"])
+
+
+class TestQuery(unittest.TestCase):
+    """Test cases for the unified query API"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.shop = SweetShopManager(os.path.join(self.tmpdir.name, 'data.json'))
+        self.shop.add_item("Kaju Katli", 20, 50.0, "Nut-Based")
+        self.shop.add_item("Gulab Jamun", 50, 10.0, "Milk-Based")
+        self.shop.add_item("Rasgulla", 40, 12.0, "Milk-Based")
+        self.shop.add_item("Badam Burfi", 18, 60.0, "Nut-Based")
+        self.shop.add_item("Jalebi", 35, 15.0, "Candy")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_combined_predicates(self):
+        """Test criteria are combined with AND"""
+        results = self.shop.query(category=SweetCategory.MILK_BASED, max_price=11.0)
+
+        self.assertEqual([s.name for s in results], ["Gulab Jamun"])
+
+    def test_sort_limit_offset(self):
+        """Test sorting with a limit and offset pages through the results"""
+        results = self.shop.query(sort_by='price', descending=True, limit=2, offset=1)
+
+        self.assertEqual([s.name for s in results], ["Kaju Katli", "Jalebi"])
+
+    def test_explain_picks_selective_index(self):
+        """Test the planner uses the most selective index and top-k sorting"""
+        plan = self.shop.explain(category='Candy', min_price=0.0, sort_by='name', limit=1)
+
+        self.assertEqual(plan.access_path, 'category_index')
+        self.assertEqual(plan.estimated_rows, 1)
+        self.assertEqual(plan.sort, 'top_k_heap')
+
+    def test_index_refreshed_after_write(self):
+        """Test indexes see items added after the first query"""
+        self.shop.query(category='Candy')
+        self.shop.add_item("Peda", 10, 8.0, "Candy")
+
+        self.assertEqual(len(self.shop.query(category='Candy')), 2)
+
+    def test_invalid_sort_key(self):
+        """Test sorting by an unknown field raises ValueError"""
+        with self.assertRaises(ValueError):
+            self.shop.query(sort_by='colour')
+
+    def test_unknown_category_matches_nothing(self):
+        """Test search_by_category keeps returning [] for unknown categories"""
+        self.assertEqual(self.shop.search_by_category('Bogus'), [])
+        with self.assertRaises(ValueError):
+            self.shop.query(category='Bogus')
+
+
+class TestWebApp(unittest.TestCase):
+    """Test cases for the Flask routes"""
+
+    def setUp(self):
+        import app
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.old_data_file = sweet_shop_manager.DATA_FILE
+        sweet_shop_manager.DATA_FILE = os.path.join(self.tmpdir.name, 'data.json')
+        integrity.write(sweet_shop_manager.DATA_FILE, {
+            'sweets': [{'id': 1001, 'name': "Kaju Katli", 'category': "Nut-Based",
+                        'price': 50.0, 'quantity': 20}],
+            'next_id': 1001,
+            'version': 1
+        })
+        self.client = app.app.test_client()
+
+    def tearDown(self):
+        sweet_shop_manager.DATA_FILE = self.old_data_file
+        self.tmpdir.cleanup()
+
+    def test_invalid_edit_rejected(self):
+        """Test an edit with negative stock is refused and the list still renders"""
+        form = {'name': "Kaju Katli", 'quantity': -1, 'price': 50.0, 'category': "Nut-Based"}
+        response = self.client.post('/edit/1001', data=form)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(sweet_shop_manager.get_all_items()[0]['quantity'], 20)
+        self.assertEqual(self.client.get('/').status_code, 200)
+
+    def test_invalid_add_rejected(self):
+        """Test adds with an unknown category or bad price are refused"""
+        for form in ({'name': "Ladoo", 'quantity': 5, 'price': 10.0, 'category': "Bogus"},
+                     {'name': "Ladoo", 'quantity': 5, 'price': 'nan', 'category': "Candy"},
+                     {'name': "Ladoo", 'quantity': 'five', 'price': 10.0, 'category': "Candy"}):
+            self.assertEqual(self.client.post('/add', data=form).status_code, 400)
+        self.assertEqual(len(sweet_shop_manager.get_all_items()), 1)
+
+    def test_catalogue_reused_until_file_changes(self):
+        """Test searches share one catalogue and its indexes until a write"""
+        import app
+        self.client.get('/?search=kaju+katly')
+        shop = app.get_shop()
+        self.client.get('/?search=kaju+katlee')
+        self.assertIs(app.get_shop(), shop)
+
+        # Writes reload the catalogue; the fuzzy index is updated, not rebuilt
+        index = sweet_shop_manager._shared_fuzzy(sweet_shop_manager.DATA_FILE)[0]
+        form = {'name': "Kaju Katli", 'quantity': 5, 'price': 50.0, 'category': "Nut-Based"}
+        self.client.post('/edit/1001', data=form)
+        self.assertIsNot(app.get_shop(), shop)
+
+        form = {'name': "Ladoo", 'quantity': 5, 'price': 10.0, 'category': "Candy"}
+        with mock.patch('sweet_shop_manager.FuzzyIndex', side_effect=AssertionError("rebuilt")):
+            self.client.post('/add', data=form)
+            self.assertIn(b"Ladoo", self.client.get('/?search=ladooo').data)
+        self.assertIs(sweet_shop_manager._shared_fuzzy(sweet_shop_manager.DATA_FILE)[0], index)
+
+    def test_pruned_job_result_is_gone(self):
+        """Test a finished job whose result was pruned answers 410, not 500"""
+        import app
+        app.get_jobs().cache_dir = os.path.join(self.tmpdir.name, 'cache')
+        job_id = self.client.post('/jobs/report').get_json()['id']
+        job = app.get_jobs().wait(job_id, timeout=30)
+        os.remove(job.result_path)
+
+        self.assertEqual(self.client.get(f'/jobs/{job_id}/result').status_code, 410)
+        app.get_jobs().shutdown()
+
+    def test_thumbnail_urls_never_serve_the_original(self):
+        """Test a missing thumbnail redirects and an unknown size is not found"""
+        png = base64.b64decode(
+            'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg==')
+        store = SweetShopManager(sweet_shop_manager.DATA_FILE).images
+        digest = store.ingest(png)
+        shutil.rmtree(os.path.join(store.root, 'thumbs'), ignore_errors=True)
+
+        response = self.client.get(f'/images/{digest}/150')
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.headers['Location'].endswith(f'/images/{digest}'))
+        self.assertNotIn('immutable', response.headers.get('Cache-Control', ''))
+        self.assertEqual(self.client.get(f'/images/{digest}/999').status_code, 404)
+        self.assertEqual(self.client.get(f'/images/{digest}').status_code, 200)
+
+
+class TestIntegrity(unittest.TestCase):
+    """Test cases for checksummed persistence and crash recovery"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'data.json')
+        self.shop = SweetShopManager(self.path)
+        self.shop.add_item("Kaju Katli", 20, 50.0, "Nut-Based")
+        self.shop.add_item("Gulab Jamun", 50, 10.0, "Milk-Based")
+        self.shop.add_item("Jalebi", 35, 15.0, "Candy")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def corrupt(self, old, new):
+        with open(self.path, 'rb') as f:
+            raw = f.read()
+        with open(self.path, 'wb') as f:
+            f.write(raw.replace(old, new))
+
+    def crash_before_manifest_rename(self):
+        """Add a sweet, dying after the data file is renamed but before its manifest"""
+        real_replace = os.replace
+
+        def replace(src, dst):
+            if src == integrity.manifest_path(self.path) + '.tmp':
+                raise RuntimeError("simulated crash")
+            real_replace(src, dst)
+
+        with mock.patch('integrity.os.replace', replace):
+            with self.assertRaises(RuntimeError):
+                self.shop.add_item("Ladoo", 10, 25.0, "Milk-Based")
+
+    def test_saved_file_verifies(self):
+        """Test a freshly saved file passes verification"""
+        report = integrity.verify(self.path)
+
+        self.assertTrue(report.ok)
+        self.assertEqual(report.records, 3)
+
+    def test_verify_reports_bad_record(self):
+        """Test verification pinpoints the damaged record"""
+        self.corrupt(b'Gulab', b'Gu"ab')
+
+        report = integrity.verify(self.path)
+        self.assertFalse(report.ok)
+        self.assertEqual(report.bad_ids, [1002])
+
+    def test_recover_from_backup(self):
+        """Test loading a damaged file restores records from the last snapshot"""
+        self.corrupt(b'Gulab', b'Gu"ab')
+
+        shop = SweetShopManager(self.path)
+        self.assertEqual(shop.last_recovery.restored_ids, [1002])
+        self.assertEqual(shop.last_recovery.lost_ids, [])
+        self.assertEqual([s.name for s in shop.get_all_items()],
+                         ["Kaju Katli", "Gulab Jamun", "Jalebi"])
+
+    def test_recovery_does_not_write(self):
+        """Test loading leaves the damaged file alone and the next save keeps the good backup"""
+        with open(integrity.backup_path(self.path), 'rb') as f:
+            backup = f.read()
+        self.corrupt(b'Gulab', b'Gu"ab')
+
+        shop = SweetShopManager(self.path)
+        self.assertIsNotNone(shop.last_recovery)
+        self.assertFalse(integrity.verify(self.path).ok)
+        shop.save_to_file()
+        self.assertTrue(integrity.verify(self.path).ok)
+        with open(integrity.backup_path(self.path), 'rb') as f:
+            self.assertEqual(f.read(), backup)
+
+    def test_record_missing_from_snapshot_is_lost(self):
+        """Test a damaged record with no older copy is reported as lost"""
+        self.corrupt(b'Jalebi', b'Ja"ebi')
+
+        shop = SweetShopManager(self.path)
+        self.assertEqual(shop.last_recovery.lost_ids, [1003])
+        self.assertEqual(len(shop.get_all_items()), 2)
+
+    def test_corrupt_without_snapshot_raises(self):
+        """Test unreadable data with no snapshot raises CorruptDataError"""
+        for path in (integrity.manifest_path(self.path), integrity.backup_path(self.path)):
+            os.remove(path)
+        with open(self.path, 'w') as f:
+            f.write('{"sweets": [')
+        shop = SweetShopManager(self.path)  # the file is only read on first use
+
+        with self.assertRaises(integrity.CorruptDataError):
+            shop.get_all_items()
+
+    def test_crash_between_renames_completes_write(self):
+        """Test a write interrupted between its two renames is rolled forward"""
+        self.crash_before_manifest_rename()
+
+        shop = SweetShopManager(self.path)
+        self.assertIsNone(shop.last_recovery)
+        self.assertEqual([s.name for s in shop.get_all_items()][-1], "Ladoo")
+        self.assertTrue(integrity.verify(self.path).ok)
+
+    def test_valid_file_with_old_manifest_is_accepted(self):
+        """Test records the manifest does not cover are kept when the file is valid"""
+        self.crash_before_manifest_rename()
+        os.remove(integrity.manifest_path(self.path) + '.tmp')
+
+        shop = SweetShopManager(self.path)
+        self.assertIsNone(shop.last_recovery)
+        self.assertEqual(len(shop.get_all_items()), 4)
+        self.assertTrue(integrity.verify(self.path).ok)
+
+    def test_hand_edited_file_is_reindexed(self):
+        """Test a re-indented, edited file is loaded as it is and given a new manifest"""
+        with open(self.path) as f:
+            data = json.load(f)
+        data['sweets'][1]['price'] = 12.5
+        data['sweets'].append({'id': 1010, 'name': 'Ladoo', 'category': 'Milk-Based',
+                               'price': 25.0, 'quantity': 10})
+        with open(self.path, 'w') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        with open(self.path, 'rb') as f:
+            edited = f.read()
+
+        shop = SweetShopManager(self.path)
+        self.assertIsNone(shop.last_recovery)
+        self.assertEqual(shop.query(name='Gulab')[0].price, 12.5)
+        self.assertEqual(len(shop.get_all_items()), 4)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), edited)
+        self.assertTrue(integrity.verify(self.path).ok)
+
+        # The new manifest locates records, so later damage is still pinpointed
+        self.corrupt(b'Ladoo', b'La"oo')
+        self.assertEqual(integrity.verify(self.path).bad_ids, [1010])
+
+    def test_shifted_records_matched_by_id(self):
+        """Test intact records moved by damage elsewhere are not reported as damaged"""
+        self.corrupt(b'Kaju Katli', b'Kaju "Katli')
+
+        shop = SweetShopManager(self.path)
+        self.assertEqual(shop.last_recovery.bad_ids, [1001])
+        self.assertEqual(shop.last_recovery.restored_ids, [1001])
+        self.assertEqual([s.name for s in shop.get_all_items()],
+                         ["Kaju Katli", "Gulab Jamun", "Jalebi"])
+
+    def test_missing_file_keeps_manifest_version(self):
+        """Test restoring a deleted file never reuses the version its manifest recorded"""
+        version = self.shop.version
+        os.remove(self.path)
+
+        data, report = integrity.load(self.path)
+        self.assertIsNotNone(report)
+        self.assertEqual(data['version'], version)
+
+    @unittest.skipUnless(integrity.fcntl, "needs fcntl")
+    def test_lock_excludes_other_processes(self):
+        """Test another process cannot load while the data file is locked"""
+        code = f"import integrity; integrity.load({self.path!r}); print('loaded')"
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+        with integrity._locked(self.path):
+            child = subprocess.Popen([sys.executable, '-c', code], env=env,
+                                     stdout=subprocess.PIPE, text=True)
+            with self.assertRaises(subprocess.TimeoutExpired):
+                child.wait(timeout=1)
+        self.assertEqual(child.communicate(timeout=30)[0].strip(), 'loaded')
+
+    def test_fsck_command(self):
+        """Test 'python CLI.py fsck FILE' reports and sets the exit status"""
+        cli = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'CLI.py')
+        result = subprocess.run([sys.executable, cli, 'fsck', self.path],
+                                capture_output=True, text=True, cwd=self.tmpdir.name)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn("OK (3 records)", result.stdout)
+
+        self.corrupt(b'Gulab', b'Gu"ab')
+        result = subprocess.run([sys.executable, cli, 'fsck', self.path],
+                                capture_output=True, text=True, cwd=self.tmpdir.name)
+        self.assertEqual(result.returncode, 1, result.stderr)
+        self.assertIn("bad records: 1002", result.stdout)
+
+
+class TestImageStore(unittest.TestCase):
+    """Test cases for the local content-addressed image store"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = ImageStore(os.path.join(self.tmpdir.name, 'images'))
+        # 1x1 transparent PNG
+        self.png = base64.b64decode(
+            'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg==')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_ingest_is_content_addressed(self):
+        """Test identical content is stored once under its digest"""
+        first = self.store.ingest(self.png)
+        second = self.store.ingest(self.png)
+
+        self.assertEqual(first, second)
+        self.assertTrue(self.store.exists(first))
+        self.assertEqual(self.store.mime_type(self.store.path(first)), 'image/png')
+
+    def test_invalid_digest_rejected(self):
+        """Test digests that could escape the store raise ValueError"""
+        with self.assertRaises(ValueError):
+            self.store.path('../../etc/passwd')
+
+    def test_sweet_keeps_image_fields(self):
+        """Test to_dict/from_dict round-trip the image fields"""
+        data = {'id': 1001, 'name': 'Kaju Katli', 'category': 'Nut-Based', 'price': 50.0,
+                'quantity': 20, 'image_url': 'https://example.com/k.jpg', 'image': 'ab' * 32}
+
+        self.assertEqual(Sweet.from_dict(data).to_dict(), data)
+
+    def test_import_existing_image_urls(self):
+        """Test the importer links local copies of image_url entries"""
+        path = os.path.join(self.tmpdir.name, 'data.json')
+        shop = SweetShopManager(path, images=self.store)
+        shop.add_item("Kaju Katli", 20, 50.0, "Nut-Based")
+        shop.add_item("Jalebi", 35, 15.0, "Candy")
+        for sweet in shop.get_all_items():
+            sweet.image_url = f"https://cdn.example.com/img/{sweet.id}.cms?w=800"
+        shop.save_to_file()
+        source = os.path.join(self.tmpdir.name, 'downloads')
+        os.mkdir(source)
+        with open(os.path.join(source, 'kaju-katli.png'), 'wb') as f:
+            f.write(self.png)
+
+        result = import_images(path, source, self.store)
+        self.assertEqual(result, {'imported': [1001], 'missing': [1002], 'unreadable': []})
+        self.assertTrue(self.store.exists(SweetShopManager(path).query(name='Kaju')[0].image))
+
+
+class TestLoadGenerator(unittest.TestCase):
+    """Test cases for the point-of-sale load generator"""
+
+    def test_percentile(self):
+        """Test nearest-rank percentiles"""
+        values = [float(i) for i in range(1, 101)]
+
+        self.assertEqual(loadgen.percentile(values, 50), 50.0)
+        self.assertEqual(loadgen.percentile(values, 99), 99.0)
+        self.assertEqual(loadgen.percentile([], 95), 0.0)
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'data.json')
+        integrity.write(self.path, {
+            'sweets': [{'id': 1001, 'name': "Kaju Katli", 'category': "Nut-Based",
+                        'price': 50.0, 'quantity': 20}],
+            'next_id': 1001,
+            'version': 1
+        })
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_short_run_against_local_server(self):
+        """Test a short single-client run reports traffic and passes consistency checks"""
+        data_file = sweet_shop_manager.DATA_FILE
+        url, stop = loadgen.start_local_server(self.path)
+        try:
+            generator = loadgen.LoadGenerator(url, rate=50, clients=1, seed=1)
+            report = generator.run(0.5)
+        finally:
+            stop()
+
+        summary = report.to_dict()
+        self.assertGreater(summary['total']['count'], 0)
+        self.assertEqual(summary['total']['errors'], 0)
+        self.assertEqual(report.consistency, [])
+        self.assertEqual(sweet_shop_manager.DATA_FILE, data_file)
+
+    def test_fallbacks_counted_as_the_operation_run(self):
+        """Test edits and deletes with nothing to act on are counted as home and add"""
+        generator = loadgen.LoadGenerator('http://127.0.0.1:1', mix={'edit': 1}, seed=1)
+        self.assertEqual(generator._choose(generator.client_random(0)), ('home', None))
+
+        generator = loadgen.LoadGenerator('http://127.0.0.1:1', mix={'delete': 1}, seed=1)
+        rng = generator.client_random(0)
+        self.assertEqual(generator._choose(rng), ('add', None))
+        generator.created_ids.append(1005)
+        self.assertEqual(generator._choose(rng), ('delete', 1005))
+
+    def test_seed_reproduces_each_client(self):
+        """Test every client draws the same operations for a seed, whatever the others do"""
+        def draws(generator, n):
+            rng = generator.client_random(n)
+            return [generator._choose(rng)[0] for _ in range(20)]
+
+        first = loadgen.LoadGenerator('http://127.0.0.1:1', clients=4, seed=7)
+        second = loadgen.LoadGenerator('http://127.0.0.1:1', clients=4, seed=7)
+        draws(second, 0)  # another client's draws do not shift client 1
+
+        self.assertEqual(draws(first, 1), draws(second, 1))
+        self.assertNotEqual(draws(first, 1), draws(first, 2))
+
+
+class TestFuzzySearch(unittest.TestCase):
+    """Test cases for typo-tolerant name search"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.shop = SweetShopManager(os.path.join(self.tmpdir.name, 'data.json'))
+        for name in ["Kaju Katli", "Gulab Jamun", "Rasgulla", "Dark Chocolate", "Jalebi"]:
+            self.shop.add_item(name, 10, 20.0)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_typos_are_matched(self):
+        """Test misspelt names still find the right sweet"""
+        self.assertEqual(self.shop.fuzzy_search("gulab jamon")[0].name, "Gulab Jamun")
+        self.assertEqual(self.shop.fuzzy_search("kaju katl")[0].name, "Kaju Katli")
+
+    def test_transliteration_variants(self):
+        """Test common romanization variants normalize to the same form"""
+        self.assertEqual(normalize("Gulaab Jamoon"), normalize("Gulab Jamun"))
+        self.assertEqual(self.shop.fuzzy_search("jalebee", max_distance=0)[0].name, "Jalebi")
+
+    def test_max_distance_limits_matches(self):
+        """Test matches beyond the maximum distance are excluded"""
+        self.assertEqual(self.shop.fuzzy_search("choclate", max_distance=0), [])
+        self.assertEqual(self.shop.fuzzy_search("xyz"), [])
+
+    def test_index_follows_adds_renames_and_deletes(self):
+        """Test the shared index is updated in place as the catalogue changes"""
+        self.assertEqual(self.shop.fuzzy_search("jalebee")[0].name, "Jalebi")
+        self.shop.add_item("Motichoor Ladoo", 10, 20.0)
+        jalebi = self.shop.query(name="Jalebi")[0]
+        jalebi.name = "Imarti"
+        self.shop.save_to_file()
+
+        shop = SweetShopManager(self.shop.filename)
+        self.assertEqual(shop.fuzzy_search("motichur ladu")[0].name, "Motichoor Ladoo")
+        self.assertEqual(shop.fuzzy_search("imarty")[0].name, "Imarti")
+        self.assertEqual(shop.fuzzy_search("jalebee"), [])
+
+        index = FuzzyIndex([(1, "Rasgulla"), (2, "Rasmalai")])
+        index.remove(1)
+        self.assertEqual(index.search("rasgula"), [])
+        index.update([(2, "Rasmalai"), (3, "Rasgulla")])
+        self.assertEqual(index.search("rasgula"), [(0, 3)])
+
+    def test_bk_tree_search(self):
+        """Test the BK-tree returns every term within the distance"""
+        tree = BKTree()
+        for term in ["book", "books", "cake", "boo", "cape", "cart"]:
+            tree.add(term)
+
+        self.assertEqual(sorted(tree.search("book", 1)), [(0, "book"), (1, "boo"), (1, "books")])
+
+
+class TestStartup(unittest.TestCase):
+    """Test cases for deferred loading and the catalogue cache"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, 'data.json')
+        shop = SweetShopManager(self.filename)
+        shop.add_item("Kaju Katli", 10, 50.0, "Nut-Based")
+        shop.add_item("Gulab Jamun", 20, 30.0, "Milk-Based")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_construction_does_not_read_the_file(self):
+        """Test the inventory is only read on first use"""
+        filename = os.path.join(self.tmpdir.name, 'new.json')
+        shop = SweetShopManager(filename)
+        self.assertFalse(os.path.exists(filename))
+
+        self.assertEqual(shop.get_all_items(), [])
+        self.assertTrue(os.path.exists(filename))
+
+    def test_cache_is_written_and_reused(self):
+        """Test a second load comes from the catalogue cache"""
+        self.assertEqual(len(SweetShopManager(self.filename).get_all_items()), 2)
+        self.assertTrue(os.path.exists(catalogue_cache_path(self.filename)))
+
+        shop = SweetShopManager(self.filename)
+        self.assertTrue(shop._load_cache())
+        self.assertEqual(sorted(s.name for s in shop.get_all_items()), ["Gulab Jamun", "Kaju Katli"])
+        self.assertEqual(shop.version, 3)
+
+    def test_stale_cache_is_ignored(self):
+        """Test changes to the data file are never hidden by an old cache"""
+        SweetShopManager(self.filename).get_all_items()
+        SweetShopManager(self.filename).add_item("Jalebi", 5, 20.0)
+
+        shop = SweetShopManager(self.filename)
+
+        self.assertFalse(shop._load_cache())
+        self.assertEqual(len(shop.get_all_items()), 3)
+        self.assertEqual(SweetShopManager(self.filename).version, 4)
+
+    def test_damaged_cache_is_ignored(self):
+        """Test a cache failing its checksum is treated as a miss"""
+        SweetShopManager(self.filename).get_all_items()
+        path = catalogue_cache_path(self.filename)
+        with open(path, 'rb') as f:
+            raw = bytearray(f.read())
+        raw[-3] ^= 0xff
+        with open(path, 'wb') as f:
+            f.write(raw)
+
+        shop = SweetShopManager(self.filename)
+
+        self.assertFalse(shop._load_cache())
+        self.assertEqual(len(shop.get_all_items()), 2)
+
+    def test_crafted_cache_row_is_ignored(self):
+        """Test a well-formed cache holding a row Sweet rejects is treated as a miss"""
+        shop = SweetShopManager(self.filename)
+        shop.get_all_items()
+        path = catalogue_cache_path(self.filename)
+        with open(path, 'rb') as f:
+            header = json.loads(f.readline())
+        payload = marshal.dumps((1003, shop.version, [(1001, 42, 'Candy', 10.0, 5, None, None)]))
+        header['crc32'] = zlib.crc32(payload)
+        with open(path, 'wb') as f:
+            f.write(json.dumps(header).encode() + b'\n' + payload)
+
+        shop = SweetShopManager(self.filename)
+        self.assertFalse(shop._load_cache())
+        self.assertEqual(len(shop.get_all_items()), 2)
+
+
 if __name__ == '__main__':
     unittest.main()
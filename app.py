@@ -1,47 +1,89 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify
+from flask import Flask, render_template, request, redirect, url_for, jsonify, send_file, abort
+import os
+import threading
 import sweet_shop_manager
 
-app = Flask(__name__)
+# Templates live next to this file rather than in templates/
+app = Flask(__name__, template_folder='.')
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+
+# The job pool and image store are only needed by a few routes, so they are
+# imported and created on first use to keep worker start-up fast.
+_jobs = None
+_images = None
+
+# One catalogue per process, so its indexes (price, category, fuzzy BK-trees)
+# are built once and reused until the data file changes.
+_shop = None
+_shop_lock = threading.Lock()
+
+def get_shop():
+    global _shop
+    with _shop_lock:
+        if _shop is None or _shop.filename != sweet_shop_manager.DATA_FILE or _shop.is_stale():
+            _shop = sweet_shop_manager.SweetShopManager(sweet_shop_manager.DATA_FILE)
+            _shop.load_from_file()  # once, rather than in every request racing for it
+        return _shop
+
+_jobs_lock = threading.Lock()
+
+def get_jobs():
+    global _jobs
+    old = None
+    with _jobs_lock:
+        if _jobs is None or _jobs.filename != sweet_shop_manager.DATA_FILE:
+            from jobs import JobManager
+            old, _jobs = _jobs, JobManager(sweet_shop_manager.DATA_FILE)
+        jobs = _jobs
+    if old is not None:
+        old.shutdown()
+    return jobs
+
+def get_images():
+    global _images
+    from image_store import ImageStore, store_root
+    # The same store SweetShopManager uses for this data file
+    root = store_root(sweet_shop_manager.DATA_FILE)
+    if _images is None or _images.root != root:
+        _images = ImageStore(root)
+    return _images
 
 # ------------------------
 # Home page: List + Search + Sort
 # ------------------------
 @app.route('/')
 def home():
-    search_query = request.args.get('search', '').lower()
+    search_query = request.args.get('search', '').strip()
     sort_by = request.args.get('sort_by', '')
 
-    items = sweet_shop_manager.get_all_items()
-
-    # Filter by search query
-    if search_query:
-        items = [
-            i for i in items
-            if search_query in i['name'].lower()
-            or search_query in i['category'].lower()
-        ]
-
-    # Sort results
-    if sort_by == 'name':
-        items = sorted(items, key=lambda x: x['name'].lower())
-    elif sort_by == 'price':
-        items = sorted(items, key=lambda x: x['price'])
-    elif sort_by == 'category':
-        items = sorted(items, key=lambda x: x['category'].lower())
+    shop = get_shop()
+    sweets = shop.query(
+        text=search_query or None,
+        sort_by=sort_by if sort_by in ('name', 'price', 'category') else None
+    )
+    # Nothing matched exactly: fall back to ranked, typo-tolerant matches
+    fuzzy = bool(search_query) and not sweets
+    if fuzzy:
+        sweets = shop.fuzzy_search(search_query)
+    items = [s.to_dict() for s in sweets]
 
-    return render_template('index.html', items=items)
+    return render_template('index.html', items=items, fuzzy=fuzzy, search=search_query)
 
 # ------------------------
 # Add new sweet
 # ------------------------
 @app.route('/add', methods=['POST'])
 def add_item():
-    name = request.form['name']
-    quantity = int(request.form['quantity'])
-    price = float(request.form['price'])
-    category = request.form['category']
-
-    sweet_shop_manager.add_item(name, quantity, price, category)
+    # Invalid values (negative stock, unknown category, ...) are rejected before
+    # they reach the file, where they would break every page that lists it
+    try:
+        name = request.form['name']
+        quantity = int(request.form['quantity'])
+        price = float(request.form['price'])
+        category = request.form['category']
+        sweet_shop_manager.add_item(name, quantity, price, category)
+    except ValueError:
+        abort(400)
     return redirect(url_for('home'))
 
 # ------------------------
@@ -58,12 +100,14 @@ def delete_sweet(sweet_id):
 @app.route('/edit/<int:sweet_id>', methods=['GET', 'POST'])
 def edit_sweet(sweet_id):
     if request.method == 'POST':
-        name = request.form['name']
-        quantity = int(request.form['quantity'])
-        price = float(request.form['price'])
-        category = request.form['category']
-
-        sweet_shop_manager.update_item(sweet_id, name, quantity, price, category)
+        try:
+            name = request.form['name']
+            quantity = int(request.form['quantity'])
+            price = float(request.form['price'])
+            category = request.form['category']
+            sweet_shop_manager.update_item(sweet_id, name, quantity, price, category)
+        except ValueError:
+            abort(400)
         return redirect(url_for('home'))
 
     items = sweet_shop_manager.get_all_items()
@@ -77,8 +121,80 @@ def edit_sweet(sweet_id):
 def api_items():
     return jsonify(sweet_shop_manager.get_all_items())
 
+# ------------------------
+# Local images: content-addressed, so responses never change
+# ------------------------
+@app.route('/images/<digest>')
+@app.route('/images/<digest>/<int:size>')
+def image(digest, size=None):
+    images = get_images()
+    try:
+        path = images.path(digest) if size is None else images.thumbnail_path(digest, size)
+    except ValueError:
+        abort(404)
+    if not os.path.exists(path):
+        # No thumbnail (yet): point at the original rather than serving its
+        # bytes under this URL, which must never change once cached
+        if size is not None and images.exists(digest):
+            return redirect(url_for('image', digest=digest))
+        abort(404)
+    response = send_file(os.path.abspath(path), mimetype=images.mime_type(path), etag=digest)
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE
+    return response
+
+# ------------------------
+# Background jobs: heavy reports and exports
+# ------------------------
+@app.route('/jobs/<kind>', methods=['POST'])
+def submit_job(kind):
+    params = {}
+    if kind == 'export':
+        params['fmt'] = request.args.get('format', 'csv')
+        if params['fmt'] not in ('csv', 'json'):
+            abort(400)
+    try:
+        job = get_jobs().submit(kind, sweet_shop_manager.get_inventory_version(), **params)
+    except ValueError:
+        abort(404)
+    return jsonify(get_jobs().status(job.id)), 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    try:
+        return jsonify(get_jobs().status(job_id))
+    except KeyError:
+        abort(404)
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    jobs = get_jobs()
+    try:
+        job = jobs.get(job_id)
+    except KeyError:
+        abort(404)
+    if job.status != 'done':
+        return jsonify(jobs.status(job_id)), 409
+    try:
+        return send_file(job.result_path, as_attachment=job.kind == 'export')
+    except FileNotFoundError:
+        abort(410)  # results for old inventory versions are pruned by maintenance
+
 # ------------------------
 # Run Flask app
 # ------------------------
 if __name__ == '__main__':
-    app.run(debug=True)
+    scheduler = None
+    # With the debug reloader the parent process only watches files, so
+    # maintenance runs in the child that actually serves requests.
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        from scheduler import maintenance_scheduler
+        from jobs import CACHE_DIR
+        scheduler = maintenance_scheduler(sweet_shop_manager.DATA_FILE, cache_dir=CACHE_DIR)
+        scheduler.start()
+    try:
+        app.run(debug=True)
+    finally:
+        if scheduler is not None:
+            scheduler.shutdown()
+        if _jobs is not None:
+            _jobs.shutdown()
@@ -0,0 +1,157 @@
+# bench_startup.py
+
+"""
+Start-up benchmark
+Every measurement runs in a fresh interpreter so nothing is already imported
+or cached in memory: import time of the entry points, CLI fsck wall time, the
+web app's first response, and a cold versus cached load of a generated
+catalogue.
+
+Usage: python bench_startup.py [--items 100000] [--repeat 5] [--json]
+"""
+
+from typing import Dict, List
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Each snippet prints the seconds it measured; wall time is taken by the parent
+IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+FIRST_RESPONSE_SNIPPET = """
+import time
+start = time.perf_counter()
+import sweet_shop_manager
+sweet_shop_manager.DATA_FILE = {data_file!r}
+import app
+response = app.app.test_client().get('/')
+assert response.status_code == 200, response.status_code
+print(time.perf_counter() - start)
+"""
+
+CATALOGUE_SNIPPET = """
+import time
+start = time.perf_counter()
+from sweet_shop_manager import SweetShopManager
+shop = SweetShopManager({data_file!r})
+count = len(shop.get_all_items())
+print(time.perf_counter() - start)
+"""
+
+
+def _run(args: List[str], cwd: str = HERE) -> float:
+    """Run a command in a fresh interpreter; returns its printed timing or wall time"""
+    env = dict(os.environ, PYTHONPATH=HERE)
+    start = time.perf_counter()
+    result = subprocess.run(args, cwd=cwd, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"{' '.join(args[:3])} failed:\n{result.stderr.strip()}")
+    try:
+        return float(result.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        return elapsed
+
+
+def _snippet(code: str, cwd: str = HERE) -> float:
+    return _run([sys.executable, '-c', code], cwd)
+
+
+def _summary(samples: List[float]) -> Dict:
+    return {
+        'min_ms': min(samples) * 1000,
+        'median_ms': statistics.median(samples) * 1000,
+        'max_ms': max(samples) * 1000,
+    }
+
+
+def make_catalogue(filename: str, items: int, seed: int = 0):
+    """Write a checksummed data file with the given number of sweets"""
+    import integrity
+    from sweet_shop_manager import SweetCategory
+
+    rng = random.Random(seed)
+    categories = [c.value for c in SweetCategory]
+    sweets = [{'id': 1001 + i, 'name': f"Sweet {i}", 'category': rng.choice(categories),
+               'price': round(rng.uniform(5, 500), 2), 'quantity': rng.randint(0, 200)}
+              for i in range(items)]
+    integrity.write(filename, {'sweets': sweets, 'next_id': 1001 + items, 'version': 1},
+                    keep_backup=False)
+
+
+def run(items: int = 100000, repeat: int = 5) -> Dict[str, Dict]:
+    results = {}
+    for module in ('sweet_shop_manager', 'CLI', 'app'):
+        try:
+            results[f'import {module}'] = _summary(
+                [_snippet(IMPORT_SNIPPET.format(module=module)) for _ in range(repeat)])
+        except RuntimeError as e:
+            results[f'import {module}'] = {'error': str(e).splitlines()[-1]}
+
+    with tempfile.TemporaryDirectory(prefix='bench-') as workdir:
+        data_file = os.path.join(workdir, 'data.json')
+        make_catalogue(data_file, items)
+        cache = data_file + '.cache'
+
+        try:
+            results['CLI fsck'] = _summary(
+                [_run([sys.executable, os.path.join(HERE, 'CLI.py'), 'fsck', data_file], workdir)
+                 for _ in range(repeat)])
+        except RuntimeError as e:
+            results['CLI fsck'] = {'error': str(e).splitlines()[-1]}
+
+        results['app first response'] = _summary(
+            [_snippet(FIRST_RESPONSE_SNIPPET.format(data_file=data_file), workdir)
+             for _ in range(repeat)])
+
+        cold = []
+        for _ in range(repeat):
+            if os.path.exists(cache):
+                os.remove(cache)
+            cold.append(_snippet(CATALOGUE_SNIPPET.format(data_file=data_file), workdir))
+        results[f'catalogue load, {items} items, cold'] = _summary(cold)
+        # The last cold run left a fresh cache behind
+        results[f'catalogue load, {items} items, cached'] = _summary(
+            [_snippet(CATALOGUE_SNIPPET.format(data_file=data_file), workdir)
+             for _ in range(repeat)])
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure cold start-up of the CLI and web app")
+    parser.add_argument('--items', type=int, default=100000, help="catalogue size for load timings")
+    parser.add_argument('--repeat', type=int, default=5, help="fresh processes per measurement")
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    args = parser.parse_args(argv)
+    if args.items < 0 or args.repeat <= 0:
+        parser.error("--items must be non-negative and --repeat positive")
+
+    results = run(args.items, args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return 0
+    width = max(len(name) for name in results)
+    print(f"{'measurement':<{width}}{'min ms':>10}{'median ms':>12}{'max ms':>10}")
+    for name, r in results.items():
+        if 'error' in r:
+            print(f"{name:<{width}}  {r['error']}")
+        else:
+            print(f"{name:<{width}}{r['min_ms']:>10.1f}{r['median_ms']:>12.1f}{r['max_ms']:>10.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
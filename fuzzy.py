@@ -0,0 +1,180 @@
+# fuzzy.py
+
+"""
+Typo-tolerant name matching
+Names are normalized with transliteration-friendly folding (so "jamoon",
+"jamun" and "jaamun" meet) and indexed in a BK-tree, which prunes most of the
+catalogue using the triangle inequality instead of comparing every name.
+"""
+
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import re
+import unicodedata
+
+# Applied in order to each word after lowercasing
+FOLDS = [
+    (r'chh', 'ch'),
+    (r'([kgbdtj])h', r'\1'),    # aspirates: kh, gh, bh, dh, th, jh
+    (r'sh', 's'),
+    (r'ph', 'f'),
+    (r'w', 'v'),
+    (r'z', 'j'),
+    (r'q', 'k'),
+    (r'ck', 'k'),
+    (r'ee|ii', 'i'),
+    (r'oo|uu|ou', 'u'),
+    (r'aa', 'a'),
+    (r'y$', 'i'),
+    (r'([^aeiou])\1', r'\1'),  # doubled consonants: rasgulla -> rasgula
+]
+FOLD_RES = [(re.compile(pattern), repl) for pattern, repl in FOLDS]
+
+
+def normalize(text: str) -> str:
+    """Lowercase, strip accents and punctuation, and fold common spelling variants"""
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower()
+    words = re.findall(r'[a-z0-9]+', text)
+    folded = []
+    for word in words:
+        for pattern, repl in FOLD_RES:
+            word = pattern.sub(repl, word)
+        folded.append(word)
+    return ' '.join(folded)
+
+
+def levenshtein(a: str, b: str) -> int:
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+class BKTree:
+    """Burkhard-Keller tree over strings under edit distance"""
+
+    def __init__(self):
+        self._root: Optional[Tuple[str, Dict[int, tuple]]] = None
+        self.size = 0
+
+    def add(self, term: str):
+        if self._root is None:
+            self._root = (term, {})
+            self.size = 1
+            return
+        node = self._root
+        while True:
+            distance = levenshtein(term, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (term, {})
+                self.size += 1
+                return
+            node = child
+
+    def search(self, query: str, max_distance: int) -> List[Tuple[int, str]]:
+        """All terms within max_distance of query, as (distance, term) pairs"""
+        if self._root is None:
+            return []
+        found = []
+        stack = [self._root]
+        while stack:
+            term, children = stack.pop()
+            distance = levenshtein(query, term)
+            if distance <= max_distance:
+                found.append((distance, term))
+            for edge in range(distance - max_distance, distance + max_distance + 1):
+                child = children.get(edge)
+                if child is not None:
+                    stack.append(child)
+        return found
+
+
+def token_budget(token: str, max_distance: int) -> int:
+    # Short words tolerate fewer edits, or "ras" would match half the menu
+    return min(max_distance, max(1, len(token) // 3))
+
+
+class FuzzyIndex:
+    """Name index that is updated in place as sweets are added, renamed or removed
+
+    BK-trees cannot drop terms, so removed names stay in the trees; they map to
+    no ids and are skipped when searching.
+    """
+
+    def __init__(self, names: Iterable[Tuple[int, str]] = ()):
+        self._by_id: Dict[int, str] = {}
+        self._names: Dict[str, Set[int]] = {}
+        self._tokens: Dict[str, Set[int]] = {}
+        self._name_tree = BKTree()
+        self._token_tree = BKTree()
+        for sweet_id, name in names:
+            self.add(sweet_id, name)
+
+    def add(self, sweet_id: int, name: str):
+        if sweet_id in self._by_id:
+            self.remove(sweet_id)
+        self._by_id[sweet_id] = name
+        key = normalize(name)
+        self._names.setdefault(key, set()).add(sweet_id)
+        self._name_tree.add(key)
+        for token in key.split():
+            self._tokens.setdefault(token, set()).add(sweet_id)
+            self._token_tree.add(token)
+
+    def remove(self, sweet_id: int):
+        name = self._by_id.pop(sweet_id, None)
+        if name is None:
+            return
+        key = normalize(name)
+        for table, terms in ((self._names, [key]), (self._tokens, key.split())):
+            for term in terms:
+                ids = table.get(term)
+                if ids is not None:
+                    ids.discard(sweet_id)
+                    if not ids:
+                        del table[term]
+
+    def update(self, names: Iterable[Tuple[int, str]]):
+        """Bring the index in line with names, touching only what changed"""
+        current = dict(names)
+        for sweet_id in [i for i, name in self._by_id.items() if current.get(i) != name]:
+            self.remove(sweet_id)
+        for sweet_id, name in current.items():
+            if sweet_id not in self._by_id:
+                self.add(sweet_id, name)
+
+    def search(self, query: str, max_distance: int = 2) -> List[Tuple[int, int]]:
+        """Matching ids ranked by distance, as (distance, id) pairs"""
+        key = normalize(query)
+        if not key:
+            return []
+        scores: Dict[int, int] = {}
+
+        for distance, name in self._name_tree.search(key, max_distance):
+            for sweet_id in self._names.get(name, ()):
+                scores[sweet_id] = min(scores.get(sweet_id, distance), distance)
+
+        # Every query word must match some word of the name; scores add up
+        per_token: Optional[Dict[int, int]] = None
+        for token in key.split():
+            best: Dict[int, int] = {}
+            for distance, term in self._token_tree.search(token, token_budget(token, max_distance)):
+                for sweet_id in self._tokens.get(term, ()):
+                    best[sweet_id] = min(best.get(sweet_id, distance), distance)
+            if per_token is None:
+                per_token = best
+            else:
+                per_token = {i: d + best[i] for i, d in per_token.items() if i in best}
+        for sweet_id, distance in (per_token or {}).items():
+            if distance <= max_distance:
+                scores[sweet_id] = min(scores.get(sweet_id, distance), distance)
+
+        return sorted((d, i) for i, d in scores.items())
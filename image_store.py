@@ -0,0 +1,180 @@
+# image_store.py
+
+"""
+Local content-addressed image store
+Images are stored once under their SHA-256 digest with resized thumbnails
+precomputed at ingest time, so pages never hotlink third-party hosts.
+Thumbnails need Pillow; without it the original image is served instead.
+"""
+
+from typing import Dict, List, Optional, Union
+import glob
+import hashlib
+import io
+import os
+import re
+import sys
+
+import integrity
+
+IMAGE_DIR = 'image_store'
+THUMBNAIL_SIZES = (150, 300)
+DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+MIME_TYPES = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'RIFF', 'image/webp'),
+]
+
+
+def load_pillow():
+    """Pillow's Image module, imported on first use; None if not installed"""
+    try:
+        from PIL import Image
+    except ImportError:  # thumbnails are optional
+        return None
+    return Image
+
+
+def sniff_mime_type(head: bytes) -> str:
+    for magic, mime in MIME_TYPES:
+        if head.startswith(magic):
+            return mime
+    return 'application/octet-stream'
+
+
+def store_root(data_file: str) -> str:
+    """Image store used for a data file: the image_store directory beside it"""
+    return os.path.join(os.path.dirname(os.path.abspath(data_file)), IMAGE_DIR)
+
+
+class ImageStore:
+    def __init__(self, root: str = IMAGE_DIR, sizes=THUMBNAIL_SIZES):
+        self.root = root
+        self.sizes = tuple(sizes)
+
+    def _check(self, digest: str):
+        if not DIGEST_RE.match(digest):
+            raise ValueError(f"Invalid image digest: {digest!r}")
+
+    def path(self, digest: str) -> str:
+        self._check(digest)
+        return os.path.join(self.root, 'objects', digest[:2], digest)
+
+    def thumbnail_path(self, digest: str, size: int) -> str:
+        """Path of the thumbnail; it only exists if Pillow was available at ingest"""
+        self._check(digest)
+        if size not in self.sizes:
+            raise ValueError(f"No {size}px thumbnails are generated")
+        return os.path.join(self.root, 'thumbs', str(size), digest[:2], digest + '.jpg')
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self.path(digest))
+
+    def mime_type(self, path: str) -> str:
+        with open(path, 'rb') as f:
+            return sniff_mime_type(f.read(16))
+
+    def ingest(self, source: Union[str, bytes]) -> str:
+        """Store an image from a file path or raw bytes and return its digest"""
+        if isinstance(source, str):
+            with open(source, 'rb') as f:
+                source = f.read()
+        digest = hashlib.sha256(source).hexdigest()
+        self._make_thumbnails(digest, source)
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(source)
+            os.replace(path + '.tmp', path)
+        return digest
+
+    def _make_thumbnails(self, digest: str, data: bytes):
+        Image = load_pillow()
+        if Image is None:
+            return
+        for size in self.sizes:
+            path = self.thumbnail_path(digest, size)
+            if os.path.exists(path):
+                continue
+            try:
+                with Image.open(io.BytesIO(data)) as img:
+                    img = img.convert('RGB')
+                    img.thumbnail((size, size))
+            except (OSError, SyntaxError, ValueError) as e:
+                raise ValueError(f"Not a readable image: {e}")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            img.save(path + '.tmp', 'JPEG', quality=85)
+            os.replace(path + '.tmp', path)
+
+
+# ------------------------
+# One-off importer for existing image_url entries
+# ------------------------
+
+def _slug(name: str) -> str:
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')
+
+
+def find_local_image(record: Dict, source_dir: str) -> Optional[str]:
+    """Look for a downloaded copy named by id, name slug or URL file name"""
+    stems = [str(record['id']), _slug(record['name'])]
+    url_name = record.get('image_url', '').split('?')[0].rstrip('/').rsplit('/', 1)[-1]
+    if url_name:
+        stems.append(url_name)
+    for stem in stems:
+        exact = os.path.join(source_dir, stem)
+        if os.path.isfile(exact):
+            return exact
+        matches = sorted(glob.glob(os.path.join(source_dir, glob.escape(stem) + '.*')))
+        if matches:
+            return matches[0]
+    return None
+
+
+def import_images(filename: str, source_dir: str, store: ImageStore) -> Dict[str, List[int]]:
+    """Ingest local copies of image_url entries and record their digests"""
+    data, _ = integrity.load(filename)
+    result = {'imported': [], 'missing': [], 'unreadable': []}
+    for record in data.get('sweets', []):
+        if record.get('image') or not record.get('image_url'):
+            continue
+        path = find_local_image(record, source_dir)
+        if path is None:
+            result['missing'].append(record['id'])
+            continue
+        try:
+            record['image'] = store.ingest(path)
+        except ValueError:
+            result['unreadable'].append(record['id'])
+            continue
+        result['imported'].append(record['id'])
+    if result['imported']:
+        data['version'] = data.get('version', 0) + 1
+        integrity.write(filename, data)
+    return result
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) < 2:
+        print("Usage: python image_store.py DATA_FILE SOURCE_DIR [STORE_DIR]")
+        return 2
+    store = ImageStore(argv[2] if len(argv) > 2 else store_root(argv[0]))
+    result = import_images(argv[0], argv[1], store)
+    print(f"Imported {len(result['imported'])} images")
+    if result['missing']:
+        print(f"No local file for ids: {', '.join(map(str, result['missing']))}")
+    if result['unreadable']:
+        print(f"Unreadable image for ids: {', '.join(map(str, result['unreadable']))}")
+    if load_pillow() is None:
+        print("Pillow is not installed; thumbnails were not generated")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,505 @@
+# integrity.py
+
+"""
+Checksummed persistence and crash recovery for the inventory file
+The data file stays plain JSON with one record per line; a sidecar manifest
+(<file>.sum) holds a whole-file CRC plus the offset, length and CRC of every
+record so damage can be located without parsing the JSON.
+"""
+
+from typing import Dict, List, Optional, Tuple
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import glob
+import json
+import logging
+import os
+import re
+import shutil
+import struct
+import threading
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of one process are serialized
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+HEAD = b'{"sweets": [\n'
+SEPARATOR = b',\n'
+RECORD = struct.Struct('<qQII')  # id, offset, length, crc32
+
+# Serializes writers, and keeps readers from seeing a new file with the old
+# manifest, between threads of one process (e.g. a threaded web server).
+# _locked() adds an flock on <file>.lock for other processes.
+_lock = threading.RLock()
+_held: Dict[str, Tuple[Optional[int], int]] = {}  # lock path -> (fd, depth)
+
+
+class CorruptDataError(ValueError):
+    """Raised when a data file is damaged and no snapshot can replace it"""
+    pass
+
+
+@dataclass
+class FsckReport:
+    filename: str
+    ok: bool
+    records: int = 0
+    bad_ids: List[int] = field(default_factory=list)
+    tail_ok: bool = True
+    message: str = ''
+
+    def __str__(self) -> str:
+        if self.ok:
+            return f"{self.filename}: OK ({self.records} records)" + \
+                (f" - {self.message}" if self.message else '')
+        lines = [f"{self.filename}: CORRUPT - {self.message}"]
+        if self.bad_ids:
+            lines.append(f"  bad records: {', '.join(map(str, self.bad_ids))}")
+        if not self.tail_ok:
+            lines.append("  next_id/version trailer is damaged")
+        return "\n".join(lines)
+
+
+@dataclass
+class RecoveryReport:
+    filename: str
+    snapshot: Optional[str] = None
+    bad_ids: List[int] = field(default_factory=list)
+    restored_ids: List[int] = field(default_factory=list)
+    lost_ids: List[int] = field(default_factory=list)
+    notes: List[str] = field(default_factory=list)
+
+    def __str__(self) -> str:
+        lines = [f"Recovered {self.filename}"]
+        if self.snapshot:
+            lines.append(f"  using snapshot {self.snapshot}")
+        if self.bad_ids:
+            lines.append(f"  damaged records: {', '.join(map(str, self.bad_ids))}")
+        if self.restored_ids:
+            lines.append(f"  restored from snapshot: {', '.join(map(str, self.restored_ids))}")
+        if self.lost_ids:
+            lines.append(f"  lost: {', '.join(map(str, self.lost_ids))}")
+        lines += [f"  {note}" for note in self.notes]
+        return "\n".join(lines)
+
+
+def manifest_path(filename: str) -> str:
+    return filename + '.sum'
+
+
+def backup_path(filename: str) -> str:
+    return filename + '.bak'
+
+
+def checkpoint_dir(filename: str) -> str:
+    return filename + '.checkpoints'
+
+
+def lock_path(filename: str) -> str:
+    return filename + '.lock'
+
+
+@contextmanager
+def _locked(filename: str):
+    """Hold the data file's lock against other threads and other processes
+
+    Re-entrant: a write made while loading reuses the lock already held.
+    """
+    path = lock_path(os.path.abspath(filename))
+    with _lock:
+        fd, depth = _held.get(path, (None, 0))
+        if depth == 0 and fcntl is not None:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        _held[path] = (fd, depth + 1)
+        try:
+            yield
+        finally:
+            if depth == 0:
+                del _held[path]
+                if fd is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                    os.close(fd)
+            else:
+                _held[path] = (fd, depth)
+
+
+# ------------------------
+# Writing
+# ------------------------
+
+def encode(data: Dict) -> Tuple[bytes, bytes]:
+    """Serialize data to (file bytes, manifest bytes)"""
+    rest = {k: v for k, v in data.items() if k != 'sweets'}
+    parts = [HEAD]
+    index = bytearray()
+    offset = len(HEAD)
+    for i, record in enumerate(data.get('sweets', [])):
+        if i:
+            parts.append(SEPARATOR)
+            offset += len(SEPARATOR)
+        chunk = json.dumps(record).encode()
+        index += RECORD.pack(record['id'], offset, len(chunk), zlib.crc32(chunk))
+        parts.append(chunk)
+        offset += len(chunk)
+    tail = b'\n]' + (b', ' + json.dumps(rest).encode()[1:-1] if rest else b'') + b'}\n'
+    parts.append(tail)
+    body = b''.join(parts)
+    header = {
+        'format': FORMAT_VERSION,
+        'size': len(body),
+        'crc32': zlib.crc32(body),
+        'tail': [offset, len(tail), zlib.crc32(tail)],
+        'version': data.get('version'),
+    }
+    return body, json.dumps(header).encode() + b'\n' + bytes(index)
+
+
+def _write_synced(path: str, payload: bytes):
+    with open(path, 'wb') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _snapshot(src: str, dst: str):
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def write(filename: str, data: Dict, keep_backup: bool = True):
+    """Atomically replace filename, keeping the previous version as <file>.bak
+
+    The data file is renamed into place before its manifest. If the process
+    dies between the two renames, load() finds <file>.sum.tmp matching the
+    new file and completes the write. A file that fails its checksum never
+    replaces the backup.
+    """
+    body, manifest = encode(data)
+    with _locked(filename):
+        _write_synced(filename + '.tmp', body)
+        _write_synced(manifest_path(filename) + '.tmp', manifest)
+        if keep_backup and os.path.exists(filename):
+            current = _read_manifest(filename)
+            if current is not None and not _intact(_read(filename), current[0]):
+                logger.warning("%s is damaged; keeping the previous backup", filename)
+            else:
+                _snapshot(filename, backup_path(filename))
+                if current is not None:
+                    _snapshot(manifest_path(filename), manifest_path(backup_path(filename)))
+        os.replace(filename + '.tmp', filename)
+        os.replace(manifest_path(filename) + '.tmp', manifest_path(filename))
+
+
+# ------------------------
+# Verification
+# ------------------------
+
+def _read(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _read_manifest(filename: str) -> Optional[Tuple[Dict, bytes]]:
+    return _read_manifest_at(manifest_path(filename))
+
+
+def _read_manifest_at(path: str) -> Optional[Tuple[Dict, bytes]]:
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return _parse_manifest(f.read())
+
+
+def _parse_manifest(raw: bytes) -> Optional[Tuple[Dict, bytes]]:
+    header, _, index = raw.partition(b'\n')
+    try:
+        header = json.loads(header)
+    except ValueError:
+        return None
+    if header.get('format') != FORMAT_VERSION or len(index) % RECORD.size:
+        return None
+    return header, index
+
+
+def _check(raw: bytes, header: Dict, index: bytes) -> Tuple[List[int], bool]:
+    """Per-record check; returns (bad record ids, trailer intact)"""
+    view = memoryview(raw)
+    bad = []
+    for rid, offset, length, crc in RECORD.iter_unpack(index):
+        if offset + length > len(raw) or zlib.crc32(view[offset:offset + length]) != crc:
+            bad.append(rid)
+    offset, length, crc = header['tail']
+    tail_ok = offset + length <= len(raw) and zlib.crc32(view[offset:offset + length]) == crc
+    return bad, tail_ok
+
+
+def _intact(raw: bytes, header: Dict) -> bool:
+    return len(raw) == header['size'] and zlib.crc32(raw) == header['crc32']
+
+
+def verify(filename: str) -> FsckReport:
+    """Check a data file against its manifest without parsing the JSON"""
+    if not os.path.exists(filename):
+        return FsckReport(filename, False, message="file is missing")
+    with open(filename, 'rb') as f:
+        raw = f.read()
+    manifest = _read_manifest(filename)
+    if manifest is not None and _intact(raw, manifest[0]):
+        return FsckReport(filename, True, len(manifest[1]) // RECORD.size)
+    pending = _read_manifest_at(manifest_path(filename) + '.tmp')
+    if pending is not None and _intact(raw, pending[0]):
+        return FsckReport(filename, True, len(pending[1]) // RECORD.size,
+                          message="last write was interrupted; it completes on the next load")
+    if manifest is None:
+        return FsckReport(filename, False, message="no valid checksum manifest")
+    header, index = manifest
+    records = len(index) // RECORD.size
+    bad, tail_ok = _check(raw, header, index)
+    message = f"expected {header['size']} bytes, found {len(raw)}" if len(raw) != header['size'] \
+        else "checksum mismatch"
+    return FsckReport(filename, False, records, bad, tail_ok, message)
+
+
+def read_verified(filename: str) -> Optional[Tuple[bytes, bytes, Dict]]:
+    """The data file, its manifest and the manifest header, if they match"""
+    with _locked(filename):
+        if not os.path.exists(filename) or not os.path.exists(manifest_path(filename)):
+            return None
+        with open(filename, 'rb') as f:
+            raw = f.read()
+        with open(manifest_path(filename), 'rb') as f:
+            manifest_raw = f.read()
+    manifest = _parse_manifest(manifest_raw)
+    if manifest is None or not _intact(raw, manifest[0]):
+        return None
+    return raw, manifest_raw, manifest[0]
+
+
+def fingerprint(filename: str) -> int:
+    """CRC32 of the data file's content, from its manifest when that covers it"""
+    with _locked(filename):
+        manifest = _read_manifest(filename)
+        if manifest is not None and manifest[0]['size'] == os.path.getsize(filename):
+            return manifest[0]['crc32']
+        return zlib.crc32(_read(filename))
+
+
+# ------------------------
+# Loading and recovery
+# ------------------------
+
+def _load_snapshot(filename: str) -> Tuple[Optional[str], Optional[Dict]]:
+    """Newest usable snapshot: <file>.bak first, then scheduler checkpoints"""
+    candidates = [backup_path(filename)]
+    candidates += sorted(glob.glob(os.path.join(checkpoint_dir(filename), '*.json')), reverse=True)
+    for path in candidates:
+        if not os.path.exists(path):
+            continue
+        manifest = _read_manifest(path)
+        with open(path, 'rb') as f:
+            raw = f.read()
+        if manifest is not None and not _intact(raw, manifest[0]):
+            continue
+        try:
+            return path, json.loads(raw)
+        except ValueError:
+            continue
+    return None, None
+
+
+def _find(raw: bytes, rid: int, offset: int, length: int, crc: int) -> Optional[int]:
+    """Offset of the intact record rid: where the manifest says, or moved by an edit"""
+    if zlib.crc32(raw[offset:offset + length]) == crc:
+        return offset
+    needle = b'{"id": %d,' % rid
+    found = raw.find(needle)
+    while found != -1:
+        if zlib.crc32(raw[found:found + length]) == crc:
+            return found
+        found = raw.find(needle, found + 1)
+    return None
+
+
+def _salvage(raw: bytes, index: bytes, report: RecoveryReport, previous: Dict[int, Dict]) -> List[Dict]:
+    """Keep intact records in manifest order, patching damaged ones from the snapshot
+
+    Records are matched by id and CRC, so an edit that shifted them elsewhere
+    in the file does not make them look damaged.
+    """
+    sweets = []
+    for rid, offset, length, crc in RECORD.iter_unpack(index):
+        found = _find(raw, rid, offset, length, crc)
+        if found is not None:
+            sweets.append(json.loads(raw[found:found + length]))
+            continue
+        report.bad_ids.append(rid)
+        if rid in previous:
+            sweets.append(previous[rid])
+            report.restored_ids.append(rid)
+        else:
+            report.lost_ids.append(rid)
+    return sweets
+
+
+def _parse_valid(raw: bytes) -> Optional[Dict]:
+    """The file's data if it parses and every record is a valid sweet"""
+    from sweet_shop_manager import Sweet
+
+    try:
+        data = json.loads(raw)
+        ids = set()
+        for record in data['sweets']:
+            ids.add(Sweet.from_dict(record).id)
+        if len(ids) != len(data['sweets']):
+            return None
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return None
+    return data
+
+
+def _layout_manifest(raw: bytes, data: Dict) -> Optional[bytes]:
+    """Manifest for a valid file laid out by hand; None if records can't be located"""
+    text = raw.decode('utf-8')
+    match = re.match(r'\s*\{\s*"sweets"\s*:\s*\[\s*', text)
+    if match is None:
+        return None
+    decoder = json.JSONDecoder()
+    index = bytearray()
+    pos, byte_pos = match.end(), len(text[:match.end()].encode())
+    for i, record in enumerate(data['sweets']):
+        if i:
+            sep = re.compile(r'\s*,\s*').match(text, pos)
+            if sep is None:
+                return None
+            byte_pos += len(text[pos:sep.end()].encode())
+            pos = sep.end()
+        try:
+            parsed, end = decoder.raw_decode(text, pos)
+        except ValueError:
+            return None
+        if parsed != record:
+            return None
+        chunk = text[pos:end].encode()
+        index += RECORD.pack(record['id'], byte_pos, len(chunk), zlib.crc32(chunk))
+        pos, byte_pos = end, byte_pos + len(chunk)
+    tail = raw[byte_pos:]
+    header = {
+        'format': FORMAT_VERSION,
+        'size': len(raw),
+        'crc32': zlib.crc32(raw),
+        'tail': [byte_pos, len(tail), zlib.crc32(tail)],
+        'version': data.get('version'),
+    }
+    return json.dumps(header).encode() + b'\n' + bytes(index)
+
+
+def _reindex(filename: str, raw: bytes, data: Dict):
+    """Replace a stale manifest; the data file itself is left as it is"""
+    manifest = _layout_manifest(raw, data)
+    if manifest is None:
+        logger.warning("%s has no up-to-date manifest and its layout cannot be indexed; "
+                       "the next save rewrites both", filename)
+        return
+    logger.warning("%s has no up-to-date manifest but is valid; writing a new one", filename)
+    _write_synced(manifest_path(filename) + '.tmp', manifest)
+    os.replace(manifest_path(filename) + '.tmp', manifest_path(filename))
+
+
+def _find_tail(raw: bytes, header: Dict) -> Optional[int]:
+    """Offset of the intact trailer: where the manifest says, or at the end of the file"""
+    offset, length, crc = header['tail']
+    for start in (offset, len(raw) - length):
+        if start >= 0 and zlib.crc32(raw[start:start + length]) == crc:
+            return start
+    return None
+
+
+def _salvage_tail(raw: bytes, header: Dict, offset: int) -> Dict:
+    length = header['tail'][1]
+    tail = raw[offset:offset + length].strip()[1:].lstrip(b', ')
+    return json.loads(b'{' + tail) if tail != b'}' else {}
+
+
+def load(filename: str) -> Tuple[Dict, Optional[RecoveryReport]]:
+    """Load a data file, recovering from the last good snapshot if it is damaged.
+
+    Returns the data and a RecoveryReport, or None when the file was intact.
+    Raises FileNotFoundError if neither the file nor a snapshot exists, and
+    CorruptDataError if the file is damaged and nothing can replace it.
+    A file that fails its checksum but parses into valid records (e.g. after a
+    hand edit) is accepted as it is and given a fresh manifest.
+    """
+    with _locked(filename):
+        return _load(filename)
+
+
+def _load(filename: str) -> Tuple[Dict, Optional[RecoveryReport]]:
+    raw = None
+    manifest = _read_manifest(filename)
+    if os.path.exists(filename):
+        raw = _read(filename)
+        if manifest is not None and _intact(raw, manifest[0]):
+            return json.loads(raw), None
+        # A write that died between its two renames: finish it
+        pending = _read_manifest_at(manifest_path(filename) + '.tmp')
+        if pending is not None and _intact(raw, pending[0]):
+            os.replace(manifest_path(filename) + '.tmp', manifest_path(filename))
+            return json.loads(raw), None
+        # Hand edited, re-indented or checked out next to an old manifest
+        data = _parse_valid(raw)
+        if data is not None:
+            _reindex(filename, raw, data)
+            return data, None
+        if manifest is None:
+            try:
+                return json.loads(raw), None
+            except ValueError:
+                pass
+
+    snapshot, snapshot_data = _load_snapshot(filename)
+    report = RecoveryReport(filename, snapshot)
+
+    if raw is None or manifest is None:
+        if snapshot_data is None:
+            if raw is None:
+                raise FileNotFoundError(filename)
+            raise CorruptDataError(f"{filename} is not valid JSON and no snapshot is available")
+        report.notes.append("file is missing" if raw is None else
+                            "file is not valid JSON and has no checksum manifest")
+        report.notes.append("any changes made after the snapshot are lost")
+        if manifest is not None and manifest[0].get('version') is not None:
+            snapshot_data['version'] = max(snapshot_data.get('version', 0), manifest[0]['version'])
+            report.notes.append("version taken from the manifest")
+        return snapshot_data, report
+
+    header, index = manifest
+    tail_at = _find_tail(raw, header)
+    tail_ok = tail_at is not None
+    previous = {s['id']: s for s in (snapshot_data or {}).get('sweets', [])}
+    data = _salvage_tail(raw, header, tail_at) if tail_ok else {}
+    data['sweets'] = _salvage(raw, index, report, previous)
+    if report.restored_ids:
+        report.notes.append("restored records may be older than the damaged ones")
+    if not tail_ok:
+        if snapshot_data is None:
+            raise CorruptDataError(f"{filename} trailer is damaged and no snapshot is available")
+        data.update({k: v for k, v in snapshot_data.items() if k != 'sweets'})
+        if header.get('version') is not None:
+            # Never reuse a version number: caches are keyed on it
+            data['version'] = max(data.get('version', 0), header['version'])
+        if data['sweets']:
+            data['next_id'] = max(data.get('next_id', 0), max(r['id'] for r in data['sweets']) + 1)
+        report.notes.append("next_id/version taken from snapshot")
+    if tail_at == header['tail'][0] and len(raw) > header['size']:
+        report.notes.append(f"{len(raw) - header['size']} unindexed trailing bytes discarded")
+    return data, report
@@ -0,0 +1,256 @@
+# jobs.py
+
+"""
+Background jobs for heavy reports and exports
+Work runs on a process pool; finished results are cached on disk keyed by
+data file, inventory version and a content checksum so repeated requests
+are served without recomputing.
+"""
+
+from typing import Dict, Optional
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor, Future
+import csv
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import uuid
+import zlib
+
+import integrity
+
+CACHE_DIR = '.report_cache'
+LOW_STOCK_THRESHOLD = 5
+PROGRESS_EVERY = 10000
+MAX_FINISHED_JOBS = 1000
+
+
+class StaleVersionError(RuntimeError):
+    """Raised when the inventory changed between submitting a job and running it"""
+    pass
+
+
+def file_tag(filename: str) -> str:
+    """Prefix of every cache entry computed from filename"""
+    return hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()[:12]
+
+
+def _load_sweets(filename: str, version: Optional[int] = None, fingerprint: Optional[int] = None):
+    with open(filename, 'rb') as f:
+        raw = f.read()
+    data = json.loads(raw)
+    # The result is cached under the submitted version and checksum, so it
+    # must be built from exactly that content
+    if version is not None and data.get('version', 0) != version:
+        raise StaleVersionError(f"Inventory changed to version {data.get('version', 0)} "
+                                f"after the job was submitted for version {version}")
+    if fingerprint is not None and zlib.crc32(raw) != fingerprint:
+        raise StaleVersionError("Inventory changed after the job was submitted")
+    return data.get('sweets', [])
+
+
+def _report_progress(progress, job_id, done, total):
+    if progress is not None and (done % PROGRESS_EVERY == 0 or done == total):
+        progress[job_id] = done / total if total else 1.0
+
+
+def _write_atomic(path: str, write):
+    # A unique temporary name, so concurrent writers never share a file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with open(fd, 'w', newline='') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def inventory_report(filename: str, out_path: str, progress=None, job_id=None,
+                     version: Optional[int] = None, fingerprint: Optional[int] = None,
+                     threshold: int = LOW_STOCK_THRESHOLD) -> str:
+    """Total value, low stock items and a per-category summary"""
+    sweets = _load_sweets(filename, version, fingerprint)
+    total = len(sweets)
+    total_value = 0.0
+    low_stock = []
+    categories: Dict[str, Dict] = {}
+    for done, s in enumerate(sweets, 1):
+        value = s['price'] * s['quantity']
+        total_value += value
+        if s['quantity'] <= threshold:
+            low_stock.append(s)
+        summary = categories.setdefault(s.get('category', 'Uncategorized'), {'count': 0, 'value': 0.0})
+        summary['count'] += 1
+        summary['value'] += value
+        _report_progress(progress, job_id, done, total)
+
+    report = {
+        'item_count': total,
+        'total_value': round(total_value, 2),
+        'low_stock': low_stock,
+        'categories': categories,
+    }
+    _write_atomic(out_path, lambda f: json.dump(report, f))
+    _report_progress(progress, job_id, total, total)
+    return out_path
+
+
+def export_inventory(filename: str, out_path: str, progress=None, job_id=None,
+                     version: Optional[int] = None, fingerprint: Optional[int] = None,
+                     fmt: str = 'csv') -> str:
+    """Full inventory export as CSV or JSON"""
+    sweets = _load_sweets(filename, version, fingerprint)
+    total = len(sweets)
+
+    def write(f):
+        if fmt == 'json':
+            json.dump(sweets, f)
+            return
+        writer = csv.writer(f)
+        writer.writerow(['id', 'name', 'category', 'price', 'quantity'])
+        for done, s in enumerate(sweets, 1):
+            writer.writerow([s['id'], s['name'], s.get('category', 'Uncategorized'),
+                             s['price'], s['quantity']])
+            _report_progress(progress, job_id, done, total)
+
+    _write_atomic(out_path, write)
+    _report_progress(progress, job_id, total, total)
+    return out_path
+
+
+TASKS = {
+    'report': (inventory_report, 'json'),
+    'export': (export_inventory, None),
+}
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    result_path: str
+    status: str = 'pending'  # pending, running, done, failed
+    cached: bool = False
+    error: Optional[str] = None
+    future: Optional[Future] = None
+
+    def to_dict(self, progress: float = 0.0) -> Dict:
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': 1.0 if self.status == 'done' else progress,
+            'cached': self.cached,
+            'error': self.error
+        }
+
+
+class JobManager:
+    def __init__(self, filename: str, cache_dir: str = CACHE_DIR, max_workers: Optional[int] = None):
+        self.filename = filename
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self._jobs: Dict[str, Job] = {}
+        self._running: Dict[str, Job] = {}  # unfinished jobs by result path
+        self._lock = threading.Lock()
+        self._pool = None
+        self._sync = None
+        self._progress = None
+
+    def _start(self):
+        # The pool and the shared progress dict spawn processes, so only
+        # pay for them once the first uncached job arrives.
+        if self._pool is None:
+            from multiprocessing import Manager
+            self._sync = Manager()
+            self._progress = self._sync.dict()
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+
+    def cache_path(self, kind: str, version: int, params: Dict,
+                   fingerprint: Optional[int] = None) -> str:
+        # The version counter restarts when a file is recreated, so the
+        # content checksum is part of the key too
+        if fingerprint is None:
+            fingerprint = integrity.fingerprint(self.filename)
+        ext = TASKS[kind][1] or params.get('fmt', 'csv')
+        digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:8]
+        name = f"{file_tag(self.filename)}-{kind}-{digest}-v{version}-{fingerprint:08x}.{ext}"
+        return os.path.abspath(os.path.join(self.cache_dir, name))
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond MAX_FINISHED_JOBS; call with the lock held"""
+        finished = [i for i, j in self._jobs.items() if j.status in ('done', 'failed')]
+        for job_id in finished[:len(finished) - MAX_FINISHED_JOBS]:
+            del self._jobs[job_id]
+
+    def submit(self, kind: str, version: int, **params) -> Job:
+        """Start a job, or return the job already computing the same result"""
+        if kind not in TASKS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fingerprint = integrity.fingerprint(self.filename)
+        result_path = self.cache_path(kind, version, params, fingerprint)
+        with self._lock:
+            if result_path in self._running:
+                return self._running[result_path]
+            self._prune()
+            job = Job(uuid.uuid4().hex, kind, result_path)
+            self._jobs[job.id] = job
+            if os.path.exists(job.result_path):
+                job.status = 'done'
+                job.cached = True
+                return job
+            self._start()
+            job.future = self._pool.submit(TASKS[kind][0], self.filename, job.result_path,
+                                           self._progress, job.id, version=version,
+                                           fingerprint=fingerprint, **params)
+            self._running[result_path] = job
+        job.future.add_done_callback(lambda f, job=job: self._finish(job, f))
+        return job
+
+    def _finish(self, job: Job, future: Future):
+        with self._lock:
+            if self._running.get(job.result_path) is job:
+                del self._running[job.result_path]
+        error = future.exception()
+        if error is None:
+            job.status = 'done'
+        else:
+            job.status = 'failed'
+            job.error = str(error)
+        if self._progress is not None:
+            self._progress.pop(job.id, None)
+
+    def get(self, job_id: str) -> Job:
+        with self._lock:
+            if job_id not in self._jobs:
+                raise KeyError(f"No job with id {job_id}")
+            return self._jobs[job_id]
+
+    def status(self, job_id: str) -> Dict:
+        job = self.get(job_id)
+        progress = 0.0
+        if job.status in ('pending', 'running') and self._progress is not None:
+            progress = self._progress.get(job.id, None)
+            if progress is None:
+                progress = 0.0
+            else:
+                job.status = 'running'
+        return job.to_dict(progress)
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Job:
+        job = self.get(job_id)
+        if job.future is not None:
+            job.future.exception(timeout=timeout)
+            if job.status in ('pending', 'running'):
+                self._finish(job, job.future)
+        return job
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._sync.shutdown()
+            self._pool = None
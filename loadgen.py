@@ -0,0 +1,347 @@
+# loadgen.py
+
+"""
+Load generator simulating point-of-sale traffic against app.py
+Drives a weighted mix of page views, API pulls and writes at a target rate
+from many concurrent clients, then reports throughput, latency percentiles,
+error rates and data-consistency checks.
+
+Usage: python loadgen.py [--rate 100] [--clients 16] [--duration 10]
+                         [--mix home=40,api=20,add=15,edit=15,delete=10]
+                         [--data data.json | --url http://host:port]
+"""
+
+from typing import Dict, List, Optional
+from dataclasses import dataclass, field
+import argparse
+import http.client
+import itertools
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import urllib.parse
+
+DEFAULT_MIX = {'home': 40, 'api': 20, 'add': 15, 'edit': 15, 'delete': 10}
+NAME_PREFIX = 'LoadTest-'
+SEARCH_TERMS = ['', 'kaju', 'jamun', 'milk', 'nut', 'choco', 'halwa', 'zzz']
+SORT_KEYS = ['', 'name', 'price', 'category']
+CATEGORIES = ['Nut-Based', 'Milk-Based', 'Vegetable-Based', 'Chocolate', 'Candy', 'Pastry']
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+@dataclass
+class OpStats:
+    count: int = 0
+    errors: int = 0
+    latencies: List[float] = field(default_factory=list)
+
+    def summary(self) -> Dict:
+        lat = sorted(self.latencies)
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'error_rate': self.errors / self.count if self.count else 0.0,
+            'p50_ms': percentile(lat, 50) * 1000,
+            'p95_ms': percentile(lat, 95) * 1000,
+            'p99_ms': percentile(lat, 99) * 1000,
+        }
+
+
+@dataclass
+class LoadReport:
+    duration: float
+    target_rate: float
+    clients: int
+    ops: Dict[str, OpStats]
+    consistency: List[str] = field(default_factory=list)
+
+    @property
+    def total(self) -> OpStats:
+        total = OpStats()
+        for stats in self.ops.values():
+            total.count += stats.count
+            total.errors += stats.errors
+            total.latencies += stats.latencies
+        return total
+
+    def to_dict(self) -> Dict:
+        return {
+            'duration': self.duration,
+            'target_rate': self.target_rate,
+            'throughput': self.total.count / self.duration if self.duration else 0.0,
+            'clients': self.clients,
+            'total': self.total.summary(),
+            'ops': {name: stats.summary() for name, stats in self.ops.items()},
+            'consistency': self.consistency,
+        }
+
+    def __str__(self) -> str:
+        d = self.to_dict()
+        lines = [
+            f"Ran {d['total']['count']} requests in {d['duration']:.1f}s with {d['clients']} clients",
+            f"Throughput: {d['throughput']:.1f} req/s (target {d['target_rate']:.1f})",
+            f"{'op':<8}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}",
+        ]
+        for name, s in list(d['ops'].items()) + [('total', d['total'])]:
+            lines.append(f"{name:<8}{s['count']:>8}{s['errors']:>8}"
+                         f"{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}")
+        if d['consistency']:
+            lines.append("Consistency problems:")
+            lines += [f"  {problem}" for problem in d['consistency']]
+        else:
+            lines.append("Consistency checks passed")
+        return "\n".join(lines)
+
+
+class LoadGenerator:
+    def __init__(self, base_url: str, rate: float = 100.0, clients: int = 16,
+                 mix: Optional[Dict[str, int]] = None, seed: Optional[int] = None):
+        if rate <= 0 or clients <= 0:
+            raise ValueError("Rate and client count must be positive")
+        mix = mix or DEFAULT_MIX
+        unknown = set(mix) - set(DEFAULT_MIX)
+        if unknown:
+            raise ValueError(f"Unknown operations in mix: {', '.join(sorted(unknown))}")
+        url = urllib.parse.urlsplit(base_url)
+        self.host, self.port = url.hostname, url.port or 80
+        self.rate = rate
+        self.clients = clients
+        self.ops = [op for op in mix if mix[op] > 0]
+        self.weights = [mix[op] for op in self.ops]
+        self.seed = seed
+        self.stats = {op: OpStats() for op in self.ops}
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._names = itertools.count()
+        self.seed_ids: List[int] = []
+        self.names: Dict[int, str] = {}
+        self.created_names = set()
+        self.created_ids: List[int] = []
+        self.deleted_ids = set()
+
+    # ------------------------
+    # HTTP helpers
+    # ------------------------
+    def _request(self, method: str, path: str, form: Optional[Dict] = None):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        try:
+            body = headers = None
+            if form is not None:
+                body = urllib.parse.urlencode(form)
+                headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+            conn.request(method, path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+    def fetch_items(self) -> List[Dict]:
+        status, body = self._request('GET', '/api/items')
+        if status != 200:
+            raise RuntimeError(f"/api/items returned {status}")
+        return json.loads(body)
+
+    # ------------------------
+    # Operations: each returns the HTTP status
+    # ------------------------
+    def client_random(self, n: int) -> random.Random:
+        """Client n's own generator, so a seeded run draws the same values per client"""
+        return random.Random(None if self.seed is None else self.seed + n)
+
+    def _choose(self, rng: random.Random):
+        """Pick the next operation and its target; call with the lock held.
+
+        Edits and deletes with nothing to act on fall back to a page view and
+        an add, and are returned (and counted) as those operations.
+        """
+        op = rng.choices(self.ops, self.weights)[0]
+        if op == 'edit':
+            ids = self.seed_ids + self.created_ids
+            return ('edit', rng.choice(ids)) if ids else ('home', None)
+        if op == 'delete':
+            # Only delete items this run created, so the seed catalogue survives
+            return ('delete', self.created_ids.pop()) if self.created_ids else ('add', None)
+        return op, None
+
+    def _home(self, rng, _=None):
+        query = urllib.parse.urlencode({'search': rng.choice(SEARCH_TERMS),
+                                        'sort_by': rng.choice(SORT_KEYS)})
+        return self._request('GET', '/?' + query)[0]
+
+    def _api(self, rng, _=None):
+        status, body = self._request('GET', '/api/items')
+        if status == 200:
+            with self._lock:
+                for item in json.loads(body):
+                    sweet_id = item['id']
+                    if item['name'] in self.created_names and sweet_id not in self.names:
+                        self.names[sweet_id] = item['name']
+                        self.created_ids.append(sweet_id)
+        return status
+
+    def _add(self, rng, _=None):
+        name = f"{NAME_PREFIX}{os.getpid()}-{next(self._names)}"
+        form = {'name': name, 'quantity': rng.randint(1, 100),
+                'price': round(rng.uniform(5, 200), 2),
+                'category': rng.choice(CATEGORIES)}
+        status = self._request('POST', '/add', form)[0]
+        if status < 400:
+            with self._lock:
+                self.created_names.add(name)
+        return status
+
+    def _edit(self, rng, sweet_id):
+        # Names are kept so adds and deletes can still be tracked by name
+        form = {'name': self.names[sweet_id], 'quantity': rng.randint(0, 100),
+                'price': round(rng.uniform(5, 200), 2),
+                'category': rng.choice(CATEGORIES)}
+        return self._request('POST', f'/edit/{sweet_id}', form)[0]
+
+    def _delete(self, rng, sweet_id):
+        status = self._request('POST', f'/delete/{sweet_id}')[0]
+        if status < 400:
+            with self._lock:
+                self.deleted_ids.add(sweet_id)
+        return status
+
+    # ------------------------
+    # Driver
+    # ------------------------
+    def _client(self, n: int, start: float, deadline: float):
+        rng = self.client_random(n)
+        while True:
+            # Open-loop pacing: request n is due at start + n / rate, and its
+            # latency is measured from that due time so a slow server cannot
+            # hide queueing delay by slowing the clients down.
+            due = start + next(self._seq) / self.rate
+            if due >= deadline:
+                return
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            with self._lock:
+                op, target = self._choose(rng)
+            try:
+                ok = getattr(self, '_' + op)(rng, target) < 400
+            except (OSError, http.client.HTTPException):
+                ok = False
+            latency = time.perf_counter() - due
+            with self._lock:
+                stats = self.stats.setdefault(op, OpStats())
+                stats.count += 1
+                stats.errors += not ok
+                stats.latencies.append(latency)
+
+    def run(self, duration: float) -> LoadReport:
+        initial = self.fetch_items()
+        self.seed_ids = [i['id'] for i in initial]
+        self.names = {i['id']: i['name'] for i in initial}
+        start = time.perf_counter()
+        deadline = start + duration
+        threads = [threading.Thread(target=self._client, args=(n, start, deadline), daemon=True)
+                   for n in range(self.clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        return LoadReport(elapsed, self.rate, self.clients, self.stats, self.check_consistency())
+
+    def check_consistency(self) -> List[str]:
+        """Compare the final catalogue with the writes the server acknowledged"""
+        items = self.fetch_items()
+        problems = []
+        ids = [i['id'] for i in items]
+        if len(ids) != len(set(ids)):
+            problems.append(f"{len(ids) - len(set(ids))} duplicate ids")
+        # Ids can be reused after lost writes, so match on the name as well
+        resurrected = [i['id'] for i in items
+                       if i['id'] in self.deleted_ids and i['name'] == self.names[i['id']]]
+        if resurrected:
+            problems.append(f"deleted items still present: {sorted(resurrected)}")
+        missing_seed = set(self.seed_ids) - set(ids)
+        if missing_seed:
+            problems.append(f"seed items lost: {sorted(missing_seed)}")
+        present = {i['name'] for i in items}
+        deleted_names = {self.names[i] for i in self.deleted_ids}
+        lost = self.created_names - deleted_names - present
+        if lost:
+            problems.append(f"{len(lost)} acknowledged adds are missing (lost updates)")
+        for item in items:
+            if item['quantity'] < 0 or item['price'] < 0:
+                problems.append(f"item {item['id']} has a negative quantity or price")
+        return problems
+
+
+def start_local_server(data_file: str):
+    """Serve app.py on a free local port against a copy of data_file"""
+    from werkzeug.serving import make_server
+    import sweet_shop_manager
+    import app
+
+    workdir = tempfile.mkdtemp(prefix='loadgen-')
+    copy = os.path.join(workdir, os.path.basename(data_file))
+    shutil.copy(data_file, copy)
+    original = sweet_shop_manager.DATA_FILE
+    sweet_shop_manager.DATA_FILE = copy
+    server = make_server('127.0.0.1', 0, app.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def stop():
+        server.shutdown()
+        server.server_close()
+        sweet_shop_manager.DATA_FILE = original
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return f"http://127.0.0.1:{server.server_port}", stop
+
+
+def parse_mix(text: str) -> Dict[str, int]:
+    mix = {}
+    for part in text.split(','):
+        op, _, weight = part.partition('=')
+        mix[op.strip()] = int(weight)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate point-of-sale traffic against app.py")
+    parser.add_argument('--rate', type=float, default=100.0, help="target requests per second")
+    parser.add_argument('--clients', type=int, default=16, help="concurrent clients")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds to run")
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help="weights, e.g. home=40,api=20,add=15,edit=15,delete=10")
+    parser.add_argument('--data', default='data.json', help="data file to copy for a local server")
+    parser.add_argument('--url', help="target an already running server instead")
+    parser.add_argument('--seed', type=int, help="seed for each client's random choices")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    if args.url:
+        base_url, stop = args.url, lambda: None
+    else:
+        base_url, stop = start_local_server(args.data)
+    try:
+        generator = LoadGenerator(base_url, args.rate, args.clients, args.mix, args.seed)
+        report = generator.run(args.duration)
+    finally:
+        stop()
+    print(json.dumps(report.to_dict(), indent=4) if args.json else report)
+    return 1 if report.consistency else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
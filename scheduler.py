@@ -0,0 +1,253 @@
+# scheduler.py
+
+"""
+In-process scheduler for periodic maintenance
+Runs checkpoints, compaction, integrity checks and low-stock alerts off the
+request path, with per-task intervals and jitter.
+"""
+
+from typing import Callable, Dict, List, Optional
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import heapq
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from integrity import checkpoint_dir, manifest_path, read_verified, verify
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVALS = {
+    'checkpoint': 300.0,
+    'compaction': 3600.0,
+    'integrity': 900.0,
+    'low_stock': 60.0,
+}
+DEFAULT_JITTER = 0.1  # fraction of the interval
+CHECKPOINT_KEEP = 5
+LOW_STOCK_THRESHOLD = 5
+
+
+@dataclass
+class ScheduledTask:
+    name: str
+    func: Callable[[], object]
+    interval: float
+    jitter: float = 0.0
+    run_on_shutdown: bool = False
+    running: bool = False
+    runs: int = 0
+    skipped: int = 0
+    last_error: Optional[str] = None
+
+    def __post_init__(self):
+        if self.interval <= 0:
+            raise ValueError("Interval must be positive")
+        if self.jitter < 0:
+            raise ValueError("Jitter cannot be negative")
+
+    def next_delay(self) -> float:
+        return self.interval + random.uniform(0, self.jitter)
+
+
+class Scheduler:
+    def __init__(self, max_workers: int = 2):
+        self._tasks: Dict[str, ScheduledTask] = {}
+        self._queue: List = []
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='maintenance')
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def add_task(self, name: str, func: Callable[[], object], interval: float,
+                 jitter: float = 0.0, run_on_shutdown: bool = False) -> ScheduledTask:
+        task = ScheduledTask(name, func, interval, jitter, run_on_shutdown)
+        with self._cond:
+            self._tasks[name] = task
+            heapq.heappush(self._queue, (time.monotonic() + task.next_delay(), name))
+            self._cond.notify()
+        return task
+
+    def get_task(self, name: str) -> ScheduledTask:
+        return self._tasks[name]
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        with self._cond:
+            while not self._stopped:
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+                due, name = self._queue[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._queue)
+                task = self._tasks[name]
+                heapq.heappush(self._queue, (time.monotonic() + task.next_delay(), name))
+                if task.running:
+                    task.skipped += 1
+                    logger.debug("Skipping %s: previous run still in progress", name)
+                    continue
+                task.running = True
+                self._pool.submit(self._run, task)
+
+    def _run(self, task: ScheduledTask):
+        try:
+            task.func()
+            task.last_error = None
+        except Exception as e:
+            task.last_error = str(e)
+            logger.exception("Maintenance task %s failed", task.name)
+        finally:
+            task.runs += 1
+            task.running = False
+
+    def shutdown(self, final_flush: bool = True):
+        """Stop scheduling, wait for running tasks, then flush once more"""
+        with self._cond:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self._pool.shutdown(wait=True)
+        if final_flush:
+            for task in self._tasks.values():
+                if task.run_on_shutdown:
+                    self._run(task)
+
+
+# ------------------------
+# Maintenance tasks
+# ------------------------
+
+def _write_file(path: str, payload: bytes):
+    with open(path + '.tmp', 'wb') as f:
+        f.write(payload)
+    os.replace(path + '.tmp', path)
+
+
+def checkpoint(filename: str) -> Optional[str]:
+    """Snapshot the data file and its manifest, if it verifies and has changed.
+
+    Recovery trusts checkpoints, so a file failing verification is never
+    copied; the snapshot keeps its manifest so recovery can check it too.
+    """
+    verified = read_verified(filename)
+    if verified is None:
+        if os.path.exists(filename):
+            logger.warning("Not checkpointing %s: it does not verify", filename)
+        return None
+    raw, manifest, header = verified
+    version = header.get('version') or 0
+    directory = checkpoint_dir(filename)
+    snapshots = sorted(glob.glob(os.path.join(directory, '*.json')))
+    if snapshots and snapshots[-1].endswith(f"-v{version}.json"):
+        return None  # unchanged since the newest checkpoint
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{time.time_ns()}-v{version}.json")
+    _write_file(manifest_path(path), manifest)
+    _write_file(path, raw)
+    return path
+
+
+def compact(filename: str, cache_dir: Optional[str] = None, keep: int = CHECKPOINT_KEEP) -> int:
+    """Prune old checkpoints and this file's report cache entries for older versions"""
+    from jobs import file_tag
+
+    removed = []
+    snapshots = sorted(glob.glob(os.path.join(checkpoint_dir(filename), '*.json')))
+    for path in snapshots[:-keep] if keep else snapshots:
+        removed.append(path)
+        if os.path.exists(manifest_path(path)):
+            os.remove(manifest_path(path))
+    if cache_dir and os.path.isdir(cache_dir) and os.path.exists(filename):
+        with open(filename) as f:
+            version = json.load(f).get('version', 0)
+        # The cache directory is shared between data files; only touch ours
+        removed += [p for p in glob.glob(os.path.join(cache_dir, file_tag(filename) + '-*'))
+                    if f"-v{version}-" not in os.path.basename(p) and not p.endswith('.tmp')]
+    for path in removed:
+        os.remove(path)
+    return len(removed)
+
+
+def check_integrity(filename: str) -> List[str]:
+    """Verify checksums, then validate every record and the id counter.
+
+    Returns a list of problems.
+    """
+    from sweet_shop_manager import Sweet
+
+    problems = []
+    if os.path.exists(manifest_path(filename)):
+        report = verify(filename)
+        if not report.ok:
+            problems.append(str(report))
+    with open(filename) as f:
+        data = json.load(f)
+    seen = set()
+    for record in data.get('sweets', []):
+        try:
+            sweet = Sweet.from_dict(record)
+        except (KeyError, ValueError, TypeError, AttributeError) as e:
+            problems.append(f"record {record.get('id')}: {e}")
+            continue
+        if sweet.id in seen:
+            problems.append(f"record {sweet.id}: duplicate id")
+        seen.add(sweet.id)
+    if seen and data.get('next_id', 0) < max(seen):
+        problems.append(f"next_id {data.get('next_id')} is below the highest id {max(seen)}")
+    for problem in problems:
+        logger.error("Integrity check on %s: %s", filename, problem)
+    return problems
+
+
+class LowStockAlerter:
+    """Logs a warning the first time an item drops to or below the threshold"""
+
+    def __init__(self, filename: str, threshold: int = LOW_STOCK_THRESHOLD):
+        self.filename = filename
+        self.threshold = threshold
+        self._alerted = set()
+
+    def __call__(self) -> List[Dict]:
+        with open(self.filename) as f:
+            sweets = json.load(f).get('sweets', [])
+        low = [s for s in sweets if s['quantity'] <= self.threshold]
+        new = [s for s in low if s['id'] not in self._alerted]
+        for s in new:
+            logger.warning("Low stock: %s (id %s) has %s left", s['name'], s['id'], s['quantity'])
+        self._alerted = {s['id'] for s in low}
+        return new
+
+
+def maintenance_scheduler(filename: str, cache_dir: Optional[str] = None,
+                          intervals: Optional[Dict[str, float]] = None,
+                          jitter: float = DEFAULT_JITTER,
+                          threshold: int = LOW_STOCK_THRESHOLD) -> Scheduler:
+    """Build a scheduler with the standard maintenance tasks for a data file"""
+    intervals = {**DEFAULT_INTERVALS, **(intervals or {})}
+    scheduler = Scheduler()
+    tasks = {
+        'checkpoint': (lambda: checkpoint(filename), True),
+        'compaction': (lambda: compact(filename, cache_dir), False),
+        'integrity': (lambda: check_integrity(filename), False),
+        'low_stock': (LowStockAlerter(filename, threshold), False),
+    }
+    for name, (func, on_shutdown) in tasks.items():
+        interval = intervals[name]
+        scheduler.add_task(name, func, interval, interval * jitter, run_on_shutdown=on_shutdown)
+    return scheduler
@@ -5,11 +5,50 @@ Sweet Shop Management System
 A TDD-based implementation for managing a sweet shop inventory
 """
 
-from typing import List, Dict, Tuple
-from dataclasses import dataclass
+from typing import List, Dict, Tuple, Optional, Iterable, Callable, Union
+from dataclasses import dataclass, field
 from enum import Enum
+import bisect
+import gc
+import heapq
+import itertools
+import logging
 import json
+import marshal
+import math
 import os
+import threading
+import zlib
+
+import integrity
+from image_store import ImageStore, store_root
+from fuzzy import FuzzyIndex
+
+logger = logging.getLogger(__name__)
+
+# The catalogue cache (<file>.cache) is a JSON header line followed by the
+# rows, marshalled as plain tuples in CACHE_FIELDS order. marshal only
+# rebuilds built-in values, never runs code, and is much faster to read
+# than the JSON data file. Like the data file, the cache must only be
+# writable by the shop's own user: it is trusted after its CRC and the
+# data file's size, mtime and inode all match.
+CATALOGUE_CACHE_FORMAT = 2
+CACHE_FIELDS = ('id', 'name', 'category', 'price', 'quantity', 'image_url', 'image')
+
+
+class SweetNotFoundError(KeyError):
+    """Raised when no sweet has the requested id"""
+    pass
+
+
+class DuplicateSweetError(ValueError):
+    """Raised when adding a sweet whose id is already taken"""
+    pass
+
+
+class InsufficientStockError(ValueError):
+    """Raised when a purchase asks for more than is in stock"""
+    pass
 
 
 class SweetCategory(Enum):
@@ -29,8 +68,12 @@ class Sweet:
     category: SweetCategory
     price: float
     quantity: int
+    image_url: Optional[str] = None
+    image: Optional[str] = None  # digest in the local ImageStore
 
     def __post_init__(self):
+        if not math.isfinite(self.price):
+            raise ValueError("Price must be a finite number")
         if self.price < 0:
             raise ValueError("Price cannot be negative")
         if self.quantity < 0:
@@ -39,13 +82,18 @@ class Sweet:
             raise ValueError("Name cannot be empty")
 
     def to_dict(self) -> Dict:
-        return {
+        data = {
             'id': self.id,
             'name': self.name,
             'category': self.category.value,
             'price': self.price,
             'quantity': self.quantity
         }
+        if self.image_url:
+            data['image_url'] = self.image_url
+        if self.image:
+            data['image'] = self.image
+        return data
 
     @classmethod
     def from_dict(cls, data: Dict) -> 'Sweet':
@@ -54,34 +102,248 @@ class Sweet:
             name=data['name'],
             category=SweetCategory(data.get('category', 'Uncategorized')),
             price=data['price'],
-            quantity=data['quantity']
+            quantity=data['quantity'],
+            image_url=data.get('image_url'),
+            image=data.get('image')
         )
 
 
+class RuleOp(Enum):
+    PERCENT = "percent"    # value is a percentage, e.g. 8 for +8%
+    ROUND = "round"        # round to the nearest multiple of value
+    SET = "set"
+    AT_LEAST = "at_least"  # max(current, value), e.g. restock up to par
+    AT_MOST = "at_most"    # min(current, value)
+
+
+@dataclass
+class BulkRule:
+    """A repricing / stock rule applied to a whole column of the catalogue"""
+    field: str
+    op: RuleOp
+    value: float
+    category: Optional[SweetCategory] = None
+
+    def __post_init__(self):
+        if self.field not in ('price', 'quantity'):
+            raise ValueError("Rule field must be 'price' or 'quantity'")
+        self.op = RuleOp(self.op)  # accepts "percent" etc., raises on unknown ops
+        if self.category is not None:
+            self.category = SweetCategory(self.category)
+        if not math.isfinite(self.value):
+            raise ValueError("Rule value must be a finite number")
+        if self.op == RuleOp.ROUND and self.value <= 0:
+            raise ValueError("Rounding step must be positive")
+
+    def apply(self, column: List[float], categories: List[SweetCategory]) -> List[float]:
+        if self.op == RuleOp.PERCENT:
+            factor = 1 + self.value / 100
+            fn = lambda v: v * factor
+        elif self.op == RuleOp.ROUND:
+            step = self.value
+            fn = lambda v: math.floor(v / step + 0.5) * step
+        elif self.op == RuleOp.SET:
+            fn = lambda v: self.value
+        elif self.op == RuleOp.AT_LEAST:
+            fn = lambda v: max(v, self.value)
+        elif self.op == RuleOp.AT_MOST:
+            fn = lambda v: min(v, self.value)
+        else:
+            raise ValueError(f"Unknown rule operation: {self.op!r}")
+
+        if self.category is None:
+            return [fn(v) for v in column]
+        return [fn(v) if c is self.category else v for v, c in zip(column, categories)]
+
+
+@dataclass
+class BulkChange:
+    id: int
+    name: str
+    field: str
+    old: float
+    new: float
+
+
+SORT_KEYS: Dict[str, Callable[[Sweet], object]] = {
+    'id': lambda s: s.id,
+    'name': lambda s: s.name.lower(),
+    'category': lambda s: s.category.value.lower(),
+    'price': lambda s: s.price,
+    'quantity': lambda s: s.quantity,
+}
+
+
+@dataclass
+class QueryPlan:
+    access_path: str          # 'category_index', 'price_index' or 'full_scan'
+    estimated_rows: int
+    filters: List[str] = field(default_factory=list)
+    sort: str = 'none'        # 'none', 'full_sort' or 'top_k_heap'
+    limit: Optional[int] = None
+    offset: int = 0
+
+    def __str__(self) -> str:
+        lines = [f"{self.access_path} (~{self.estimated_rows} rows)"]
+        lines += [f"  filter: {f}" for f in self.filters]
+        lines.append(f"  sort: {self.sort}")
+        if self.limit is not None or self.offset:
+            lines.append(f"  offset {self.offset} limit {self.limit}")
+        return "\n".join(lines)
+
+
+# One fuzzy index per data file, shared by every manager of that file and
+# updated in place: building the BK-trees for a large catalogue takes
+# seconds, while most writes touch one name or none.
+_fuzzy_indexes: Dict[str, Tuple[FuzzyIndex, threading.Lock]] = {}
+_fuzzy_indexes_lock = threading.Lock()
+
+
+def _shared_fuzzy(filename: str) -> Tuple[FuzzyIndex, threading.Lock]:
+    key = os.path.abspath(filename)
+    with _fuzzy_indexes_lock:
+        if key not in _fuzzy_indexes:
+            _fuzzy_indexes[key] = (FuzzyIndex(), threading.Lock())
+        return _fuzzy_indexes[key]
+
+
+class _Indexes:
+    """Secondary indexes over the catalogue, rebuilt lazily after writes"""
+
+    def __init__(self, sweets: Iterable[Sweet]):
+        self.by_category: Dict[SweetCategory, List[int]] = {}
+        self.names: List[Tuple[int, str]] = []
+        self.fuzzy_synced = False  # the manager's FuzzyIndex matches these names
+        by_price = []
+        for s in sweets:
+            self.names.append((s.id, s.name))
+            self.by_category.setdefault(s.category, []).append(s.id)
+            by_price.append((s.price, s.id))
+        by_price.sort()
+        self.prices = [p for p, _ in by_price]
+        self.price_ids = [i for _, i in by_price]
+
+    def price_range(self, min_price: Optional[float], max_price: Optional[float]) -> Tuple[int, int]:
+        lo = 0 if min_price is None else bisect.bisect_left(self.prices, min_price)
+        hi = len(self.prices) if max_price is None else bisect.bisect_right(self.prices, max_price)
+        return lo, max(lo, hi)
+
+
+def catalogue_cache_path(filename: str) -> str:
+    return filename + '.cache'
+
+
 class SweetShopManager:
-    def __init__(self, filename='sweet_shop_data.json'):
+    # Read from disk the first time any of these is used, see __getattr__
+    _LAZY_ATTRS = ('_sweets', '_next_id', 'version', 'last_recovery')
+
+    def __init__(self, filename='sweet_shop_data.json', images: Optional[ImageStore] = None):
         self.filename = filename
-        self._sweets: Dict[int, Sweet] = {}
-        self._next_id = 1001
-        self.load_from_file()
+        self.images = images or ImageStore(store_root(filename))
+        self._indexes: Optional[_Indexes] = None
+
+    def __getattr__(self, name):
+        # Only reached while the attribute is unset, i.e. before the first load
+        if name in SweetShopManager._LAZY_ATTRS:
+            self.load_from_file()
+            return self.__dict__[name]
+        raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+
+    def _cache_key(self) -> Tuple:
+        st = os.stat(self.filename)
+        return (CATALOGUE_CACHE_FORMAT, st.st_size, st.st_mtime_ns, st.st_ino)
+
+    def _load_cache(self) -> bool:
+        """Use the catalogue cache if it was written for the current data file"""
+        try:
+            with open(catalogue_cache_path(self.filename), 'rb') as f:
+                header = json.loads(f.readline())
+                if header['key'] != list(self._cache_key()) or header['fields'] != list(CACHE_FIELDS):
+                    return False
+                payload = f.read()
+            if zlib.crc32(payload) != header['crc32']:
+                return False
+            # Building a million rows would otherwise set off repeated,
+            # pointless garbage collection passes
+            gc_was_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                next_id, version, rows = marshal.loads(payload)
+                categories = {c.value: c for c in SweetCategory}
+                # Rows go through Sweet again, so the cache cannot smuggle in
+                # values the data file would have rejected
+                sweets = {row[0]: Sweet(row[0], row[1], categories[row[2]], *row[3:])
+                          for row in rows}
+            finally:
+                if gc_was_enabled:
+                    gc.enable()
+        except (OSError, ValueError, EOFError, TypeError, KeyError, IndexError, AttributeError):
+            return False  # a missing, stale, damaged or crafted cache is just a miss
+        self._sweets = sweets
+        self._next_id = next_id
+        self.version = version
+        self.last_recovery = None
+        self._indexes = None
+        self._loaded_key = tuple(header['key'])
+        return True
+
+    def _write_cache(self, key: Tuple):
+        path = catalogue_cache_path(self.filename)
+        rows = [(s.id, s.name, s.category.value, s.price, s.quantity, s.image_url, s.image)
+                for s in self._sweets.values()]
+        payload = marshal.dumps((self._next_id, self.version, rows))
+        header = {'key': list(key), 'fields': list(CACHE_FIELDS), 'crc32': zlib.crc32(payload)}
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                f.write(json.dumps(header).encode() + b'\n')
+                f.write(payload)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            logger.warning("Could not write catalogue cache %s: %s", path, e)
+
+    def is_stale(self) -> bool:
+        """True once the data file was changed by someone else since it was loaded"""
+        loaded = self.__dict__.get('_loaded_key')
+        if loaded is None:
+            return False  # nothing loaded yet; the first use reads the current file
+        try:
+            return self._cache_key() != loaded
+        except FileNotFoundError:
+            return True
 
     def load_from_file(self):
-        if not os.path.exists(self.filename):
+        if self._load_cache():
+            return
+        try:
+            key = self._cache_key()
+            data, self.last_recovery = integrity.load(self.filename)
+        except FileNotFoundError:
+            self._sweets, self._next_id, self.version = {}, 1001, 0
             self.save_to_file()  # Create file with empty structure
-
-        with open(self.filename, 'r') as f:
-            data = json.load(f)
+            key = self._cache_key()
+            data, self.last_recovery = integrity.load(self.filename)
 
         self._sweets = {s['id']: Sweet.from_dict(s) for s in data.get('sweets', [])}
         self._next_id = data.get('next_id', 1001)
-
-    def save_to_file(self):
+        self.version = data.get('version', 0)
+        self._indexes = None
+        self._loaded_key = key
+        if self.last_recovery is not None:
+            # Loading never writes; the next save replaces the damaged file
+            logger.warning(str(self.last_recovery))
+        elif key == self._cache_key():
+            self._write_cache(key)
+
+    def save_to_file(self, keep_backup: bool = True):
+        self.version += 1
+        self._indexes = None
         data = {
             'sweets': [s.to_dict() for s in self._sweets.values()],
-            'next_id': self._next_id
+            'next_id': self._next_id,
+            'version': self.version
         }
-        with open(self.filename, 'w') as f:
-            json.dump(data, f, indent=4)
+        integrity.write(self.filename, data, keep_backup)
+        self._loaded_key = self._cache_key()
 
     def get_all_items(self) -> List[Sweet]:
         return list(self._sweets.values())
@@ -107,23 +369,187 @@ class SweetShopManager:
             sweet.price = price
             self.save_to_file()
 
-    def search_by_name(self, name: str) -> List[Sweet]:
-        return [s for s in self._sweets.values() if name.lower() in s.name.lower()]
+    def attach_image(self, sweet_id: int, source: Union[str, bytes]) -> Optional[str]:
+        """Ingest an image file or bytes into the image store and link it to a sweet"""
+        if sweet_id in self._sweets:
+            digest = self.images.ingest(source)
+            self._sweets[sweet_id].image = digest
+            self.save_to_file()
+            return digest
+
+    def _get_indexes(self) -> _Indexes:
+        if self._indexes is None:
+            self._indexes = _Indexes(self._sweets.values())
+        return self._indexes
+
+    def _plan(self, category: Optional[SweetCategory], min_price: Optional[float],
+              max_price: Optional[float]) -> Tuple[str, Iterable[int], int]:
+        """Pick the most selective access path; returns (name, candidate ids, estimate)"""
+        best = ('full_scan', self._sweets.keys(), len(self._sweets))
+        if category is None and min_price is None and max_price is None:
+            return best
+        indexes = self._get_indexes()
+        if category is not None:
+            ids = indexes.by_category.get(category, [])
+            if len(ids) < best[2]:
+                best = ('category_index', ids, len(ids))
+        if min_price is not None or max_price is not None:
+            lo, hi = indexes.price_range(min_price, max_price)
+            if hi - lo < best[2]:
+                best = ('price_index', itertools.islice(indexes.price_ids, lo, hi), hi - lo)
+        return best
+
+    def _prepare_query(self, name=None, text=None, category=None, min_price=None, max_price=None,
+                       min_quantity=None, max_quantity=None, where=None, sort_by=None,
+                       descending=False, limit=None, offset=0):
+        if isinstance(category, str):
+            category = SweetCategory(category)
+        if min_price is not None and max_price is not None and min_price > max_price:
+            raise ValueError("Minimum price cannot exceed maximum price")
+        if sort_by is not None and sort_by not in SORT_KEYS:
+            raise ValueError(f"Cannot sort by '{sort_by}'")
+        if offset < 0 or (limit is not None and limit < 0):
+            raise ValueError("Limit and offset cannot be negative")
+
+        predicates: List[Tuple[str, Callable[[Sweet], bool]]] = []
+        if name:
+            needle = name.lower()
+            predicates.append((f"name contains {name!r}", lambda s: needle in s.name.lower()))
+        if text:
+            term = text.lower()
+            predicates.append((f"name or category contains {text!r}",
+                               lambda s: term in s.name.lower() or term in s.category.value.lower()))
+        if category is not None:
+            predicates.append((f"category = {category.value}", lambda s: s.category is category))
+        if min_price is not None:
+            predicates.append((f"price >= {min_price}", lambda s: s.price >= min_price))
+        if max_price is not None:
+            predicates.append((f"price <= {max_price}", lambda s: s.price <= max_price))
+        if min_quantity is not None:
+            predicates.append((f"quantity >= {min_quantity}", lambda s: s.quantity >= min_quantity))
+        if max_quantity is not None:
+            predicates.append((f"quantity <= {max_quantity}", lambda s: s.quantity <= max_quantity))
+        if where is not None:
+            predicates.append(("custom predicate", where))
+
+        access_path, ids, estimate = self._plan(category, min_price, max_price)
+        if sort_by is None:
+            sort = 'none'
+        elif limit is not None:
+            sort = 'top_k_heap'
+        else:
+            sort = 'full_sort'
+        plan = QueryPlan(access_path, estimate, [d for d, _ in predicates], sort, limit, offset)
+        return plan, ids, [p for _, p in predicates]
+
+    def query(self, name: Optional[str] = None, text: Optional[str] = None,
+              category: Union[SweetCategory, str, None] = None,
+              min_price: Optional[float] = None, max_price: Optional[float] = None,
+              min_quantity: Optional[int] = None, max_quantity: Optional[int] = None,
+              where: Optional[Callable[[Sweet], bool]] = None,
+              sort_by: Optional[str] = None, descending: bool = False,
+              limit: Optional[int] = None, offset: int = 0) -> List[Sweet]:
+        """Filter, sort and page the catalogue in one call.
+
+        All criteria are combined with AND. Without sort_by, results come back
+        in the order of the chosen access path (see explain()).
+        """
+        plan, ids, predicates = self._prepare_query(
+            name, text, category, min_price, max_price, min_quantity, max_quantity,
+            where, sort_by, descending, limit, offset)
+        rows = (self._sweets[i] for i in ids)
+        if predicates:
+            rows = (s for s in rows if all(p(s) for p in predicates))
+
+        if plan.sort == 'none':
+            stop = None if limit is None else offset + limit
+            return list(itertools.islice(rows, offset, stop))
+        key = SORT_KEYS[sort_by]
+        if plan.sort == 'top_k_heap':
+            pick = heapq.nlargest if descending else heapq.nsmallest
+            return pick(offset + limit, rows, key=key)[offset:]
+        return sorted(rows, key=key, reverse=descending)[offset:]
+
+    def explain(self, **criteria) -> QueryPlan:
+        """Return the plan query() would use for the same arguments"""
+        return self._prepare_query(**criteria)[0]
 
-    def search_by_category(self, category: str) -> List[Sweet]:
-        return [s for s in self._sweets.values() if s.category.value == category]
+    def search_by_name(self, name: str) -> List[Sweet]:
+        return self.query(name=name)
+
+    def fuzzy_search(self, name: str, max_distance: int = 2,
+                     limit: Optional[int] = None) -> List[Sweet]:
+        """Typo-tolerant name search, closest matches first"""
+        if max_distance < 0:
+            raise ValueError("Maximum distance cannot be negative")
+        indexes = self._get_indexes()
+        index, lock = _shared_fuzzy(self.filename)
+        with lock:
+            if not indexes.fuzzy_synced:
+                index.update(indexes.names)
+                indexes.fuzzy_synced = True
+            ranked = index.search(name, max_distance)
+        # Another thread may have synced the index to a newer catalogue
+        return [self._sweets[i] for _, i in ranked if i in self._sweets][:limit]
+
+    def search_by_category(self, category: Union[SweetCategory, str]) -> List[Sweet]:
+        # Unknown categories simply match nothing here, unlike query()
+        try:
+            return self.query(category=category)
+        except ValueError:
+            return []
 
     def search_by_price_range(self, min_price: float, max_price: float) -> List[Sweet]:
-        return [s for s in self._sweets.values() if min_price <= s.price <= max_price]
+        # Raises ValueError when min_price > max_price (see TDD.py)
+        return self.query(min_price=min_price, max_price=max_price)
 
     def sort_sweets_by_name(self) -> List[Sweet]:
-        return sorted(self._sweets.values(), key=lambda s: s.name.lower())
+        return self.query(sort_by='name')
 
     def sort_sweets_by_price(self, reverse=False) -> List[Sweet]:
-        return sorted(self._sweets.values(), key=lambda s: s.price, reverse=reverse)
+        return self.query(sort_by='price', descending=reverse)
 
     def sort_sweets_by_quantity(self, reverse=False) -> List[Sweet]:
-        return sorted(self._sweets.values(), key=lambda s: s.quantity, reverse=reverse)
+        return self.query(sort_by='quantity', descending=reverse)
+
+    def preview_bulk_update(self, rules: Iterable[BulkRule]) -> List[BulkChange]:
+        """Evaluate rules column-wise over the whole catalogue and return the diff"""
+        sweets = list(self._sweets.values())
+        categories = [s.category for s in sweets]
+        original = {
+            'price': [s.price for s in sweets],
+            'quantity': [s.quantity for s in sweets],
+        }
+        columns = dict(original)
+        for rule in rules:
+            columns[rule.field] = rule.apply(columns[rule.field], categories)
+
+        # Only values a rule actually changed are normalized; the rest stay as stored
+        normalize = {'price': lambda p: round(p, 2), 'quantity': lambda q: int(round(q))}
+        for field, fn in normalize.items():
+            columns[field] = [old if new == old else fn(new)
+                              for old, new in zip(original[field], columns[field])]
+        if columns['price'] and min(columns['price']) < 0:
+            raise ValueError("Price cannot be negative")
+        if columns['quantity'] and min(columns['quantity']) < 0:
+            raise ValueError("Quantity cannot be negative")
+
+        changes = []
+        for field, column in columns.items():
+            for sweet, new in zip(sweets, column):
+                old = getattr(sweet, field)
+                if new != old:
+                    changes.append(BulkChange(sweet.id, sweet.name, field, old, new))
+        return changes
+
+    def apply_bulk_update(self, rules: Iterable[BulkRule]) -> List[BulkChange]:
+        """Apply rules to the catalogue and persist the result in a single save"""
+        changes = self.preview_bulk_update(rules)
+        for change in changes:
+            setattr(self._sweets[change.id], change.field, change.new)
+        if changes:
+            self.save_to_file()
+        return changes
 
     def clear_inventory(self):
         self._sweets.clear()
@@ -133,21 +559,31 @@ class SweetShopManager:
 
 DATA_FILE = 'data.json'
 
-# Load data from JSON file
+# Load data from JSON file, recovering from the last snapshot if it is damaged
 def load_data():
-    with open(DATA_FILE, 'r') as f:
-        return json.load(f)
+    data, report = integrity.load(DATA_FILE)
+    if report is not None:
+        logger.warning(str(report))  # the next save_data replaces the damaged file
+    return data
 
-# Save data to JSON file
+# Save data to JSON file, bumping the inventory version
 def save_data(data):
-    with open(DATA_FILE, 'w') as f:
-        json.dump(data, f, indent=4)
+    data['version'] = data.get('version', 0) + 1
+    integrity.write(DATA_FILE, data)
+
+# Get the inventory version (changes on every save)
+def get_inventory_version():
+    return load_data().get('version', 0)
 
 # Get all items
 def get_all_items():
     data = load_data()
     return data['sweets']
 
+# Check a record the same way Sweet does, raising ValueError before it is saved
+def validate_item(item):
+    Sweet.from_dict(item)
+
 # Add a new item
 def add_item(name, quantity, price, category):
     data = load_data()
@@ -159,6 +595,7 @@ def add_item(name, quantity, price, category):
         "price": price,
         "quantity": quantity
     }
+    validate_item(new_sweet)
     data['sweets'].append(new_sweet)
     data['next_id'] = new_id
     save_data(data)
@@ -174,6 +611,7 @@ def update_item(sweet_id, name, quantity, price, category):
     data = load_data()
     for item in data['sweets']:
         if item['id'] == sweet_id:
+            validate_item(dict(item, name=name, quantity=quantity, price=price, category=category))
             item['name'] = name
             item['quantity'] = quantity
             item['price'] = price